@@ -5,15 +5,23 @@ import numpy as np
 import os
 import json
 import re
-from openpyxl import load_workbook
 import requests
 import threading
+import concurrent.futures
 import configparser
 import tempfile
 from pathlib import Path
 import base64
 import io
 import logging
+import sys
+import argparse
+from workbook_diff import diff_workbooks, format_diff_report, benchmark_diff
+from workbook_readers import open_workbook, iter_rows, supported_extensions, benchmark_backends
+from request_scheduler import (RequestScheduler, RateLimitError, PRIORITY_BATCH, PRIORITY_INTERACTIVE,
+                               estimate_request_tokens, estimate_text_tokens, retry_after_from_response)
+from model_routing import ModelRouter, ResponseFormatError, parse_model_tiers, validate_analysis
+from folder_watcher import FolderWatcher, RESULT_SUFFIX
 
 # Setup logging
 # logging.basicConfig(
@@ -22,14 +30,104 @@ import logging
 #     handlers=[logging.FileHandler("financial_analyzer.log"), logging.StreamHandler()]
 # )
 # logger = logging.getLogger(__name__)
+logger = logging.getLogger(__name__)
 
 class GeminiModelProcessor:
     """Handles the AI processing of Excel files using Google's Gemini API"""
     
-    def __init__(self, api_key=None):
+    # Instructions and response format shared by single and packed requests
+    SYSTEM_PROMPT = """
+            You are a financial model analysis expert. Your task is to analyze the Excel structure data provided
+            and extract the following information:
+            
+            1. Key assumptions used in the model (look for inputs, parameters, rates, growth values, etc.)
+            2. Financial returns (NPV, IRR, ROI, payback period, profit margins, etc.)
+            3. Cash flow projections and summary
+            
+            The data provided will include sheet names and rows from each sheet.
+            Use this information to identify financial model components and extract meaningful information.
+            
+            Look for patterns in the data that indicate:
+            - Input parameters or assumptions (often in dedicated sheets or sections)
+            - Calculation results showing financial returns
+            - Time series data showing cash flows or projections
+            - Summary metrics and KPIs
+            
+            Provide your analysis in a structured JSON format as follows:
+            {
+                "assumptions": [
+                    {"description": "Description of assumption", "value": "Value of assumption"}
+                ],
+                "financial_returns": {
+                    "npv": {"label": "NPV label as found", "value": "NPV value"},
+                    "irr": {"label": "IRR label as found", "value": "IRR value"},
+                    "payback_period": {"label": "Payback period label as found", "value": "Payback period value"},
+                    "roi": {"label": "ROI label as found", "value": "ROI value"},
+                    "profit_margin": {"label": "Profit margin label as found", "value": "Profit margin value"},
+                    "other_metrics": [
+                        {"label": "Other metric label", "value": "Other metric value"}
+                    ]
+                },
+                "cash_flows": [
+                    {
+                        "label": "Cash flow label",
+                        "periods": [
+                            {"period": "Period identifier", "value": "Cash flow value"}
+                        ]
+                    }
+                ],
+                "summary": "A text summary of the financial model analysis, including your interpretation of the model's purpose, key metrics, and overall financial outlook based on the data."
+            }
+            
+            Be thorough in examining all sheets and their data. If you can't find specific information, indicate that in your response.
+            Ensure your response is valid JSON and only includes the JSON. Do not include any other text before or after the JSON.
+            """
+    
+    def __init__(self, api_key=None, scheduler=None, router=None):
         self.api_key = api_key or self._load_api_key()
         self.api_base_url = "https://generativelanguage.googleapis.com/v1beta/models"
-        self.model = "gemini-2.0-flash"  # Using Gemini flash model for faster responses
+        # All requests go through the scheduler so RPM/TPM quotas are respected
+        self.scheduler = scheduler or RequestScheduler(**self._load_quota_settings())
+        # Model tiers, fastest first; workbooks escalate only when the analysis is incomplete
+        self.router = router or self._load_model_router()
+        # Small workbooks are packed into shared requests when analyzing several files
+        self.pack_token_budget = 24000
+        self.pack_max_workbook_tokens = 4000
+        self.pack_max_workbooks = 4  # keeps the combined response within maxOutputTokens
+    
+    def _load_quota_settings(self):
+        """Load API quota limits from the [Quota] section of the config file"""
+        config = configparser.ConfigParser()
+        settings = {}
+        
+        config_path = Path.home() / ".financial_analyzer" / "config.ini"
+        if config_path.exists():
+            config.read(config_path)
+            if "Quota" in config:
+                quota = config["Quota"]
+                for key in ("requests_per_minute", "tokens_per_minute", "max_concurrency"):
+                    if key in quota:
+                        settings[key] = quota.getint(key)
+        
+        return settings
+    
+    def _load_model_router(self):
+        """Build the model router from the [Models] section of the config file"""
+        config = configparser.ConfigParser()
+        tiers = None
+        hedge_percentile = None
+        
+        config_path = Path.home() / ".financial_analyzer" / "config.ini"
+        if config_path.exists():
+            config.read(config_path)
+            if "Models" in config:
+                models = config["Models"]
+                if "tiers" in models:
+                    tiers = parse_model_tiers(models["tiers"])
+                if "hedge_percentile" in models:
+                    hedge_percentile = models.getfloat("hedge_percentile") or None
+        
+        return ModelRouter(tiers, hedge_percentile=hedge_percentile, scheduler=self.scheduler)
     
     def _load_api_key(self):
         """Load API key from config file or environment variable"""
@@ -76,45 +174,41 @@ class GeminiModelProcessor:
     def _extract_and_prepare_data(self, file_path):
         """Extract key information from Excel file and prepare it for analysis"""
         try:
-            # Load workbook
-            wb = load_workbook(file_path, read_only=True, data_only=True)
-            
             excel_structure = {
                 "filename": os.path.basename(file_path),
                 "sheets": []
             }
             
-            # Process each sheet
-            for sheet_name in wb.sheetnames:
-                sheet = wb[sheet_name]
-                
-                # Extract sheet data (limited sample)
-                data = []
-                row_count = 0
-                for row in sheet.iter_rows(values_only=True):
-                    if row_count > 100:  # Limit to 100 rows per sheet for efficiency
-                        break
-                    # Convert any non-serializable types to strings
-                    processed_row = []
-                    for cell in row:
-                        if cell is None:
-                            processed_row.append(None)
-                        else:
-                            try:
-                                # Test if JSON serializable
-                                json.dumps(cell)
-                                processed_row.append(cell)
-                            except (TypeError, OverflowError):
-                                # Convert to string if not serializable
-                                processed_row.append(str(cell))
-                    data.append(processed_row)
-                    row_count += 1
-                
-                # Add sheet info
-                excel_structure["sheets"].append({
-                    "name": sheet_name,
-                    "data": data
-                })
+            # Open with the fastest reader for the file format
+            with open_workbook(file_path) as reader:
+                # Process each sheet
+                for sheet_name in reader.sheet_names:
+                    # Extract sheet data (limited sample, 100 rows per sheet for efficiency)
+                    data = []
+                    for _, row_number, values, _ in iter_rows(reader.iter_sheet(sheet_name, max_rows=101)):
+                        # Keep blank rows so the layout of the sheet is preserved
+                        while len(data) < row_number - 1:
+                            data.append([])
+                        # Convert any non-serializable types to strings
+                        processed_row = []
+                        for cell in values:
+                            if cell is None:
+                                processed_row.append(None)
+                            else:
+                                try:
+                                    # Test if JSON serializable
+                                    json.dumps(cell)
+                                    processed_row.append(cell)
+                                except (TypeError, OverflowError):
+                                    # Convert to string if not serializable
+                                    processed_row.append(str(cell))
+                        data.append(processed_row)
+                    
+                    # Add sheet info
+                    excel_structure["sheets"].append({
+                        "name": sheet_name,
+                        "data": data
+                    })
             
             # Create structured data for AI
             return excel_structure
@@ -123,13 +217,14 @@ class GeminiModelProcessor:
             logger.error(f"Error extracting data from Excel: {e}", exc_info=True)
             raise Exception(f"Failed to process Excel file: {str(e)}")
     
-    def analyze_excel_file(self, file_path, progress_callback=None):
+    def analyze_excel_file(self, file_path, progress_callback=None, priority=PRIORITY_BATCH):
         """
         Analyze Excel file using Gemini AI to extract financial model information
         
         Args:
             file_path: Path to Excel file
             progress_callback: Callback function to update progress
+            priority: Scheduling priority; PRIORITY_INTERACTIVE jumps ahead of queued batch work
         
         Returns:
             Dictionary containing analysis results
@@ -149,85 +244,160 @@ class GeminiModelProcessor:
                 progress_callback("Sending data to Gemini AI for analysis...")
             
             # Analyze with AI
-            return self._analyze_with_gemini(excel_data, progress_callback)
+            return self._analyze_with_gemini(excel_data, progress_callback, priority)
                 
         except Exception as e:
             logger.error(f"Error analyzing Excel file: {e}", exc_info=True)
             raise
     
-    def _analyze_with_gemini(self, excel_data, progress_callback=None):
-        """Analyze Excel data using Gemini API"""
-        if progress_callback:
-            progress_callback("Processing with Gemini AI model...")
+    def analyze_excel_files(self, file_paths, progress_callback=None, priority=PRIORITY_BATCH, pack=True):
+        """
+        Analyze several Excel files, packing small workbooks into shared requests
         
-        # Convert data to JSON
-        excel_data_json = json.dumps(excel_data)
+        Args:
+            file_paths: Paths to Excel files
+            progress_callback: Callback function to update progress
+            priority: Scheduling priority for the requests
+            pack: Combine small workbooks into one request up to the token budget
         
-        system_prompt = """
-            You are a financial model analysis expert. Your task is to analyze the Excel structure data provided
-            and extract the following information:
-            
-            1. Key assumptions used in the model (look for inputs, parameters, rates, growth values, etc.)
-            2. Financial returns (NPV, IRR, ROI, payback period, profit margins, etc.)
-            3. Cash flow projections and summary
-            
-            The data provided will include sheet names and rows from each sheet.
-            Use this information to identify financial model components and extract meaningful information.
-            
-            Look for patterns in the data that indicate:
-            - Input parameters or assumptions (often in dedicated sheets or sections)
-            - Calculation results showing financial returns
-            - Time series data showing cash flows or projections
-            - Summary metrics and KPIs
-            
-            Provide your analysis in a structured JSON format as follows:
-            {
-                "assumptions": [
-                    {"description": "Description of assumption", "value": "Value of assumption"}
-                ],
-                "financial_returns": {
-                    "npv": {"label": "NPV label as found", "value": "NPV value"},
-                    "irr": {"label": "IRR label as found", "value": "IRR value"},
-                    "payback_period": {"label": "Payback period label as found", "value": "Payback period value"},
-                    "roi": {"label": "ROI label as found", "value": "ROI value"},
-                    "profit_margin": {"label": "Profit margin label as found", "value": "Profit margin value"},
-                    "other_metrics": [
-                        {"label": "Other metric label", "value": "Other metric value"}
-                    ]
-                },
-                "cash_flows": [
-                    {
-                        "label": "Cash flow label",
-                        "periods": [
-                            {"period": "Period identifier", "value": "Cash flow value"}
-                        ]
-                    }
-                ],
-                "summary": "A text summary of the financial model analysis, including your interpretation of the model's purpose, key metrics, and overall financial outlook based on the data."
-            }
-            
-            Be thorough in examining all sheets and their data. If you can't find specific information, indicate that in your response.
-            Ensure your response is valid JSON and only includes the JSON. Do not include any other text before or after the JSON.
-            """
+        Returns:
+            Dictionary mapping each file path to its analysis results, or to the exception that stopped it
+        """
+        # Check if API key is set
+        if not self.api_key:
+            raise ValueError("Gemini API key is not set. Please set it in Settings.")
         
-        user_prompt = "Please analyze this Excel financial model data and extract key information about assumptions, financial returns, and cash flows. Provide the analysis in the specified JSON format."
+        results = {}
+        prepared = []
+        for file_path in file_paths:
+            if progress_callback:
+                progress_callback(f"Preparing {os.path.basename(file_path)} for analysis...")
+            try:
+                excel_data = self._extract_and_prepare_data(file_path)
+            except Exception as e:
+                results[file_path] = e
+                continue
+            prepared.append((file_path, excel_data, estimate_text_tokens(json.dumps(excel_data))))
+        
+        # Greedily fill packs in file order; large workbooks are sent on their own
+        groups = []
+        singles = []
+        current = []
+        used = 0
+        budget = self.pack_token_budget - estimate_text_tokens(self.SYSTEM_PROMPT)
+        for item in prepared:
+            if not pack or item[2] > self.pack_max_workbook_tokens:
+                singles.append(item)
+                continue
+            if current and (used + item[2] > budget or len(current) >= self.pack_max_workbooks):
+                groups.append(current)
+                current, used = [], 0
+            current.append(item)
+            used += item[2]
+        if current:
+            groups.append(current)
+        singles.extend(group[0] for group in groups if len(group) == 1)
+        groups = [group for group in groups if len(group) > 1]
+        
+        def analyze_single(item):
+            try:
+                return item[0], self._analyze_with_gemini(item[1], None, priority)
+            except Exception as e:
+                logger.error(f"Error analyzing {item[0]}: {e}", exc_info=True)
+                return item[0], e
+        
+        # The scheduler enforces the quota, so requests can be issued side by side
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.scheduler.max_concurrency) as executor:
+            packed = [executor.submit(self._analyze_packed, group, priority) for group in groups]
+            pending = [executor.submit(analyze_single, item) for item in singles]
+            for future in concurrent.futures.as_completed(packed):
+                analyses, failed = future.result()
+                results.update(analyses)
+                # Sections the model left out or got wrong are retried on their own
+                pending.extend(executor.submit(analyze_single, item) for item in failed)
+            for future in pending:
+                file_path, analysis = future.result()
+                results[file_path] = analysis
+                if progress_callback:
+                    progress_callback(f"Analyzed {len(results)} of {len(file_paths)} files")
+        
+        return results
+    
+    def _analyze_packed(self, group, priority=PRIORITY_BATCH):
+        """
+        Analyze several small workbooks in one request with a labeled section each
         
-        # Add truncated data hint to help the AI
-        if len(excel_data["sheets"]) > 0:
-            sample_count = sum(1 for sheet in excel_data["sheets"] if len(sheet.get("data", [])) >= 100)
-            if sample_count > 0:
-                user_prompt += f" Note that {sample_count} sheet(s) were truncated to the first 100 rows to manage data size."
+        Returns:
+            (dictionary of file path to analysis, list of items whose section must be retried alone)
+        """
+        labels = {f"workbook_{i}": item for i, item in enumerate(group, start=1)}
         
-        # Prepare request for Gemini API
-        url = f"{self.api_base_url}/{self.model}:generateContent?key={self.api_key}"
+        sections = []
+        for label, (file_path, excel_data, _) in labels.items():
+            sections.append(f"=== {label}: {excel_data['filename']} ==={self._truncation_note(excel_data)}\n"
+                            f"Excel Data: {json.dumps(excel_data)}")
+        
+        user_prompt = (
+            f"Please analyze these {len(group)} independent Excel financial models. Each one is in its own section labeled "
+            f"{', '.join(labels)}. Respond with a single JSON object whose keys are exactly these labels and whose "
+            f"values are the analysis of that workbook in the specified JSON format. Do not mix data between workbooks."
+        )
+        data = self._build_request(f"{user_prompt}\n\n" + "\n\n".join(sections))
         
+        def validate_pack(response):
+            if not isinstance(response, dict):
+                return ["response is not a JSON object"]
+            problems = []
+            for label in labels:
+                problems.extend(f"{label}: {problem}" for problem in validate_analysis(response.get(label)))
+            return problems
+        
+        # The request holds every workbook in the pack, so their combined size decides the model tier
+        workbook_cells = sum(self._count_cells(excel_data) for _, excel_data, _ in group)
+        
+        # Only one attempt: complete sections are kept and the rest are retried on their own,
+        # rather than resending the whole pack to a larger model
+        try:
+            response = self.router.run(
+                lambda model, timing: self._request_analysis(model, data, priority, timing=timing),
+                workbook_cells,
+                validate=validate_pack,
+                escalate=False
+            )
+        except Exception as e:
+            logger.warning(f"Packed request for {len(group)} workbooks failed, retrying individually: {e}")
+            return {}, list(group)
+        
+        analyses = {}
+        failed = []
+        for label, item in labels.items():
+            analysis = response.get(label) if isinstance(response, dict) else None
+            if validate_analysis(analysis):
+                failed.append(item)
+            else:
+                analyses[item[0]] = analysis
+        return analyses, failed
+    
+    def _truncation_note(self, excel_data):
+        """Hint for the AI when sheets were cut to the first 100 rows"""
+        sample_count = sum(1 for sheet in excel_data["sheets"] if len(sheet.get("data", [])) >= 100)
+        if sample_count > 0:
+            return f" Note that {sample_count} sheet(s) were truncated to the first 100 rows to manage data size."
+        return ""
+    
+    def _count_cells(self, excel_data):
+        """Number of extracted cells, used to pick the model tier"""
+        return sum(len(row) for sheet in excel_data["sheets"] for row in sheet.get("data", []))
+    
+    def _build_request(self, user_text):
+        """Wrap the system prompt and user text in a generateContent request body"""
         # Gemini API expects a different format than OpenAI
-        data = {
+        return {
             "contents": [
                 {
                     "parts": [
-                        {"text": system_prompt},
-                        {"text": f"{user_prompt}\n\nExcel Data: {excel_data_json}"}
+                        {"text": self.SYSTEM_PROMPT},
+                        {"text": user_text}
                     ]
                 }
             ],
@@ -239,13 +409,67 @@ class GeminiModelProcessor:
                 "responseMimeType": "application/json"
             }
         }
+    
+    def _analyze_with_gemini(self, excel_data, progress_callback=None, priority=PRIORITY_BATCH):
+        """Analyze Excel data using Gemini API"""
+        # Convert data to JSON
+        excel_data_json = json.dumps(excel_data)
+        
+        user_prompt = "Please analyze this Excel financial model data and extract key information about assumptions, financial returns, and cash flows. Provide the analysis in the specified JSON format."
+        
+        # Add truncated data hint to help the AI
+        user_prompt += self._truncation_note(excel_data)
+        
+        data = self._build_request(f"{user_prompt}\n\nExcel Data: {excel_data_json}")
+        
+        # Size of the extracted data decides which model tier the analysis starts on
+        workbook_cells = self._count_cells(excel_data)
+        
+        return self.router.run(
+            lambda model, timing: self._request_analysis(model, data, priority, progress_callback, timing),
+            workbook_cells,
+            progress_callback
+        )
+    
+    def _request_analysis(self, model, data, priority=PRIORITY_BATCH, progress_callback=None, timing=None):
+        """
+        Send a prepared request to one Gemini model and parse the JSON analysis it returns
+        
+        Args:
+            timing: RequestTiming from the model router, told when the scheduler sends the request
+        """
+        # Prepare request for Gemini API
+        url = f"{self.api_base_url}/{model}:generateContent?key={self.api_key}"
         
         headers = {
             "Content-Type": "application/json"
         }
         
-        try:
+        def send():
             response = requests.post(url, headers=headers, json=data)
+            if response.status_code == 429:
+                raise RateLimitError(f"Gemini API rate limit: {response.text}", retry_after_from_response(response))
+            return response
+        
+        try:
+            estimated_tokens = estimate_request_tokens(data)
+            future = self.scheduler.submit(send, estimated_tokens, priority)
+            if timing is not None:
+                timing.track(future)
+            
+            # Tell the user while the request is held back by the quota, including after a 429
+            waiting_reported = False
+            while True:
+                try:
+                    response = future.result(timeout=1)
+                    break
+                except concurrent.futures.TimeoutError:
+                    if not future.queued:
+                        waiting_reported = False
+                    elif progress_callback and not waiting_reported:
+                        queue_depth = self.scheduler.stats()["queue_depth"]
+                        progress_callback(f"Waiting for Gemini API quota ({queue_depth} request(s) queued)...")
+                        waiting_reported = True
             
             if response.status_code != 200:
                 logger.error(f"Gemini API error: {response.status_code} - {response.text}")
@@ -253,6 +477,10 @@ class GeminiModelProcessor:
             
             response_data = response.json()
             
+            # Let the scheduler correct its token estimate with the real count
+            usage = response_data.get("usageMetadata", {})
+            self.scheduler.record_usage(estimated_tokens, usage.get("promptTokenCount"))
+            
             # Extract content from Gemini response
             if 'candidates' in response_data and len(response_data['candidates']) > 0:
                 candidate = response_data['candidates'][0]
@@ -261,11 +489,11 @@ class GeminiModelProcessor:
                     if len(parts) > 0 and 'text' in parts[0]:
                         ai_response = parts[0]['text']
                     else:
-                        raise Exception("Unexpected response format from Gemini API")
+                        raise ResponseFormatError("Unexpected response format from Gemini API")
                 else:
-                    raise Exception("Unexpected response format from Gemini API")
+                    raise ResponseFormatError("Unexpected response format from Gemini API")
             else:
-                raise Exception("No content returned from Gemini API")
+                raise ResponseFormatError("No content returned from Gemini API")
             
             # Process the response to extract JSON
             try:
@@ -284,7 +512,7 @@ class GeminiModelProcessor:
             except json.JSONDecodeError as e:
                 logger.error(f"Error parsing JSON response: {e}", exc_info=True)
                 logger.error(f"Raw response: {ai_response[:500]}...")  # Log part of the response for debugging
-                raise Exception(f"Error parsing Gemini response as JSON: {e}")
+                raise ResponseFormatError(f"Error parsing Gemini response as JSON: {e}")
                 
         except requests.exceptions.RequestException as e:
             logger.error(f"Request error: {e}", exc_info=True)
@@ -350,11 +578,13 @@ class FinancialModelAnalyzer:
         self.assumptions_tab = ttk.Frame(self.notebook)
         self.returns_tab = ttk.Frame(self.notebook)
         self.cashflow_tab = ttk.Frame(self.notebook)
+        self.compare_tab = ttk.Frame(self.notebook)
         
         self.notebook.add(self.summary_tab, text="Summary")
         self.notebook.add(self.assumptions_tab, text="Assumptions")
         self.notebook.add(self.returns_tab, text="Financial Returns")
         self.notebook.add(self.cashflow_tab, text="Cash Flows")
+        self.notebook.add(self.compare_tab, text="Compare Versions")
         
         # Summary Text Area
         self.summary_text = scrolledtext.ScrolledText(self.summary_tab, wrap=tk.WORD)
@@ -364,6 +594,7 @@ class FinancialModelAnalyzer:
         self.setup_assumptions_tab()
         self.setup_returns_tab()
         self.setup_cashflows_tab()
+        self.setup_compare_tab()
         
         # Status bar
         self.status_var = tk.StringVar()
@@ -469,12 +700,63 @@ class FinancialModelAnalyzer:
         # Pack treeview
         self.cashflow_tree.pack(fill=tk.BOTH, expand=True)
     
-    def browse_file(self):
+    def setup_compare_tab(self):
+        # File selection rows for the two versions
+        files_frame = ttk.Frame(self.compare_tab)
+        files_frame.pack(fill=tk.X, padx=10, pady=(10, 0))
+        
+        self.old_version_var = tk.StringVar()
+        self.new_version_var = tk.StringVar()
+        
+        for row, (label, var) in enumerate([("Old version:", self.old_version_var),
+                                            ("New version:", self.new_version_var)]):
+            ttk.Label(files_frame, text=label).grid(row=row, column=0, sticky=tk.W, pady=2)
+            ttk.Entry(files_frame, textvariable=var, width=60).grid(row=row, column=1, sticky=tk.EW, padx=5, pady=2)
+            ttk.Button(files_frame, text="Browse", command=lambda v=var: self.browse_file(v)).grid(row=row, column=2, pady=2)
+        files_frame.columnconfigure(1, weight=1)
+        
+        # Compare button
+        self.compare_button = ttk.Button(files_frame, text="Compare", command=self.compare_versions)
+        self.compare_button.grid(row=0, column=3, rowspan=2, padx=(10, 0))
+        
+        # Create frame for treeview
+        frame = ttk.Frame(self.compare_tab)
+        frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        
+        # Create scrollbar
+        scrollbar = ttk.Scrollbar(frame)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        # Create treeview
+        columns = ("change", "location", "label", "old_value", "new_value")
+        self.compare_tree = ttk.Treeview(frame, columns=columns, show="headings", yscrollcommand=scrollbar.set)
+        
+        # Configure scrollbar
+        scrollbar.config(command=self.compare_tree.yview)
+        
+        # Set column headings
+        self.compare_tree.heading("change", text="Change")
+        self.compare_tree.heading("location", text="Location")
+        self.compare_tree.heading("label", text="Label")
+        self.compare_tree.heading("old_value", text="Old")
+        self.compare_tree.heading("new_value", text="New")
+        
+        # Set column widths
+        self.compare_tree.column("change", width=110)
+        self.compare_tree.column("location", width=130)
+        self.compare_tree.column("label", width=200)
+        self.compare_tree.column("old_value", width=150)
+        self.compare_tree.column("new_value", width=150)
+        
+        # Pack treeview
+        self.compare_tree.pack(fill=tk.BOTH, expand=True)
+    
+    def browse_file(self, target_var=None):
         file_path = filedialog.askopenfilename(
-            filetypes=[("Excel files", "*.xlsx *.xls")]
+            filetypes=[("Spreadsheet files", " ".join(f"*{ext}" for ext in supported_extensions()))]
         )
         if file_path:
-            self.file_path_var.set(file_path)
+            (target_var or self.file_path_var).set(file_path)
             self.status_var.set(f"Selected file: {os.path.basename(file_path)}")
     
     def analyze_file(self):
@@ -519,7 +801,8 @@ class FinancialModelAnalyzer:
             # Analyze with AI
             results = self.ai_processor.analyze_excel_file(
                 file_path, 
-                progress_callback=lambda msg: self.root.after(0, lambda: self.status_var.set(msg))
+                progress_callback=lambda msg: self.root.after(0, lambda: self.status_var.set(msg)),
+                priority=PRIORITY_INTERACTIVE
             )
             
             # Update UI with results
@@ -537,6 +820,83 @@ class FinancialModelAnalyzer:
             self.root.after(0, lambda: self.analyze_button.configure(state="normal"))
             self.root.after(0, lambda: self.browse_button.configure(state="normal"))
     
+    def compare_versions(self):
+        old_path = self.old_version_var.get()
+        new_path = self.new_version_var.get()
+        
+        if not old_path or not new_path:
+            self.status_var.set("Error: Please select both versions to compare")
+            return
+        
+        # Start progress bar
+        self.progress_bar.start(10)
+        self.compare_button.configure(state="disabled")
+        
+        for item in self.compare_tree.get_children():
+            self.compare_tree.delete(item)
+        
+        # Use threading to prevent UI freezing while scanning large workbooks
+        self.compare_thread = threading.Thread(
+            target=self._run_comparison,
+            args=(old_path, new_path)
+        )
+        self.compare_thread.daemon = True
+        self.compare_thread.start()
+    
+    def _run_comparison(self, old_path, new_path):
+        try:
+            self.root.after(0, lambda: self.status_var.set("Comparing workbook versions..."))
+            
+            report = diff_workbooks(
+                old_path,
+                new_path,
+                progress_callback=lambda msg: self.root.after(0, lambda: self.status_var.set(msg))
+            )
+            
+            self.root.after(0, lambda: self.display_comparison(report))
+            
+        except Exception as e:
+            message = f"Error: {str(e)}"
+            self.root.after(0, lambda: self.status_var.set(message))
+            logger.error(f"Error in comparison thread: {e}", exc_info=True)
+        finally:
+            self.root.after(0, lambda: self.progress_bar.stop())
+            self.root.after(0, lambda: self.compare_button.configure(state="normal"))
+    
+    def display_comparison(self, report):
+        # Return metrics first so the effect of the changes is visible at a glance
+        for metric in report["return_metrics"]:
+            change = "Metric changed" if metric["changed"] else "Metric"
+            self.compare_tree.insert("", tk.END, values=(
+                change, metric["location"], metric["label"], metric["old"], metric["new"]
+            ))
+        
+        for change in report["changed_inputs"]:
+            self.compare_tree.insert("", tk.END, values=(
+                "Input", change["location"], change["label"], change["old"], change["new"]
+            ))
+        
+        for change in report["changed_formulas"]:
+            self.compare_tree.insert("", tk.END, values=(
+                "Formula", change["location"], change["label"], change["old_formula"], change["new_formula"]
+            ))
+        
+        for move in report["moved_rows"]:
+            self.compare_tree.insert("", tk.END, values=(
+                "Moved rows", move["sheet"], "", move["from_rows"], move["to_rows"]
+            ))
+        
+        for move in report["moved_values"]:
+            self.compare_tree.insert("", tk.END, values=(
+                "Moved value", move["to"], move["value"], move["from"], move["to"]
+            ))
+        
+        stats = report["stats"]
+        self.status_var.set(
+            f"Comparison complete: {len(report['changed_inputs'])} input(s), "
+            f"{len(report['changed_formulas'])} formula(s) changed in {stats['elapsed_seconds']}s"
+        )
+    
     def _update_ui_with_results(self, results):
         # Update the results dictionary
         self.results = results
@@ -686,7 +1046,111 @@ class FinancialModelAnalyzer:
             logger.error(f"Error saving settings: {e}", exc_info=True)
 
 
-def main():
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gemini AI Financial Model Analyzer")
+    subparsers = parser.add_subparsers(dest="command")
+    
+    diff_parser = subparsers.add_parser("diff", help="Compare two versions of a financial model")
+    diff_parser.add_argument("old_file", help="Earlier version of the workbook")
+    diff_parser.add_argument("new_file", help="Later version of the workbook")
+    diff_parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    
+    bench_diff_parser = subparsers.add_parser("bench-diff", help="Time a comparison of two generated ~40 MB models")
+    bench_diff_parser.add_argument("--rows", type=int, default=330000, help="Rows in the generated cash flow sheet")
+    bench_diff_parser.add_argument("--max-seconds", type=float, help="Exit with an error if the comparison is slower")
+    
+    bench_parser = subparsers.add_parser("bench-readers", help="Compare the speed of the installed workbook readers")
+    bench_parser.add_argument("file", help="Workbook or CSV file to read")
+    bench_parser.add_argument("--repeat", type=int, default=3, help="Runs per backend (best time is reported)")
+    bench_parser.add_argument("--formulas", action="store_true", help="Only benchmark backends that read formulas")
+    
+    watch_parser = subparsers.add_parser("watch", help="Analyze new and modified workbooks in a directory")
+    watch_parser.add_argument("directory", help="Directory to watch (including subdirectories)")
+    watch_parser.add_argument("--results-dir", help="Write results here instead of next to each workbook")
+    watch_parser.add_argument("--debounce", type=float, default=5.0, help="Seconds a file must be unchanged before analysis")
+    watch_parser.add_argument("--workers", type=int, default=2, help="Maximum analyses running at once")
+    watch_parser.add_argument("--poll-interval", type=float, default=2.0, help="Seconds between scans when watchdog is not installed")
+    watch_parser.add_argument("--extensions", default=".xlsx", help="Comma-separated file extensions to analyze")
+    
+    analyze_parser = subparsers.add_parser("analyze", help="Analyze one or more workbooks without the GUI")
+    analyze_parser.add_argument("files", nargs="+", help="Workbooks to analyze")
+    analyze_parser.add_argument("--results-dir", help="Write results here instead of next to each workbook")
+    analyze_parser.add_argument("--no-pack", action="store_true", help="Send every workbook in its own request")
+    
+    args = parser.parse_args(argv)
+    
+    if args.command == "diff":
+        report = diff_workbooks(args.old_file, args.new_file)
+        if args.json:
+            print(json.dumps(report, indent=2, default=str))
+        else:
+            print(format_diff_report(report))
+        return
+    
+    if args.command == "bench-diff":
+        with tempfile.TemporaryDirectory() as directory:
+            print(f"Generating two versions of a {args.rows}-row model...")
+            result = benchmark_diff(directory, rows=args.rows)
+        stats = result["report"]["stats"]
+        print(f"Compared {result['size_mb']} MB workbooks in {result['seconds']}s "
+              f"({stats['rows_skipped']} rows identical, {stats['rows_compared']} compared)")
+        if args.max_seconds is not None and result["seconds"] > args.max_seconds:
+            print(f"Slower than the {args.max_seconds}s limit")
+            sys.exit(1)
+        return
+    
+    if args.command == "bench-readers":
+        for result in benchmark_backends(args.file, repeat=args.repeat, formulas=args.formulas):
+            if result["seconds"] is None:
+                print(f"{result['backend']:<10} failed: {result['error']}")
+            else:
+                print(f"{result['backend']:<10} {result['seconds']:>8.4f}s  {result['cells']} cells")
+        return
+    
+    if args.command == "analyze":
+        processor = GeminiModelProcessor()
+        if not processor.api_key:
+            parser.error("Gemini API key is not set. Set GEMINI_API_KEY or save it in the GUI Settings.")
+        results = processor.analyze_excel_files(args.files, progress_callback=print, pack=not args.no_pack)
+        # Keep the folder layout below the inputs' common directory, so same-named workbooks do not collide
+        common_dir = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in args.files])
+        failures = 0
+        for file_path in args.files:
+            analysis = results[file_path]
+            if isinstance(analysis, Exception):
+                failures += 1
+                print(f"FAILED {file_path}: {analysis}")
+                continue
+            if args.results_dir:
+                relative_path = os.path.relpath(os.path.abspath(file_path), common_dir)
+                result_path = os.path.join(args.results_dir, relative_path + RESULT_SUFFIX)
+                os.makedirs(os.path.dirname(result_path), exist_ok=True)
+            else:
+                result_path = file_path + RESULT_SUFFIX
+            with open(result_path, "w") as f:
+                json.dump(analysis, f, indent=2, default=str)
+            print(f"OK     {file_path} -> {result_path}")
+        sys.exit(1 if failures else 0)
+    
+    if args.command == "watch":
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+        processor = GeminiModelProcessor()
+        if not processor.api_key:
+            parser.error("Gemini API key is not set. Set GEMINI_API_KEY or save it in the GUI Settings.")
+        watcher = FolderWatcher(
+            args.directory,
+            lambda path: processor.analyze_excel_file(path, priority=PRIORITY_BATCH),
+            results_dir=args.results_dir,
+            extensions=[ext.strip() for ext in args.extensions.split(",") if ext.strip()],
+            debounce_seconds=args.debounce,
+            poll_interval=args.poll_interval,
+            max_concurrency=args.workers
+        )
+        logger.info(f"Watching {watcher.directory} (Ctrl+C to stop)")
+        watcher.run_forever()
+        return
+    
+    # No command given, launch the GUI
     root = tk.Tk()
     app = FinancialModelAnalyzer(root)
     root.mainloop()
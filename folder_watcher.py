@@ -0,0 +1,361 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import zipfile
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+STATE_FILENAME = ".financial_analyzer_watch.json"
+RESULT_SUFFIX = ".analysis.json"
+
+
+def file_signature(path):
+    """Cheap change detector: size and modification time in nanoseconds"""
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    """SHA-256 of the file contents, read in chunks so large workbooks are not loaded at once"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_complete_workbook(path):
+    """A partially written .xlsx is not yet a valid zip archive"""
+    if os.path.splitext(path)[1].lower() in (".xlsx", ".xlsm", ".xlsb"):
+        return zipfile.is_zipfile(path)
+    return True
+
+
+class FolderWatcher:
+    """
+    Watches a directory and analyzes new or modified workbooks.
+
+    A file is queued only after its size and modification time have been stable for
+    `debounce_seconds`, so workbooks still being written or rapidly re-saved are analyzed once.
+    Files whose content hash matches the last successfully analyzed version are skipped. A failed
+    analysis is retried after `retry_seconds`, doubling with each failure up to `max_retries`
+    attempts; after that the file is retried when it changes or the watcher restarts. Change
+    detection uses watchdog events when the package is installed, otherwise a stat-only poll;
+    files are only read when their signature changes, and the state file keeps that true across
+    restarts. The state file is written at most every `save_interval` seconds and on stop, so a
+    first pass over thousands of workbooks does not rewrite it after every file.
+
+    Args:
+        directory: Directory to watch (recursively)
+        analyze: Function taking a file path and returning the analysis results
+        results_dir: Where to write results; next to the source file if None
+        extensions: File extensions to analyze
+        debounce_seconds: How long a file must stay unchanged before it is analyzed
+        poll_interval: Seconds between polls when watchdog is not available
+        max_concurrency: Maximum number of analyses running at once
+        retry_seconds: Delay before the first retry of a failed analysis
+        max_retries: Failed analyses of an unchanged file retried before giving up
+        save_interval: Minimum seconds between writes of the state file
+    """
+
+    def __init__(self, directory, analyze, results_dir=None, extensions=(".xlsx",),
+                 debounce_seconds=5.0, poll_interval=2.0, max_concurrency=2,
+                 retry_seconds=30.0, max_retries=5, save_interval=2.0):
+        self.directory = os.path.abspath(directory)
+        self.analyze = analyze
+        self.results_dir = os.path.abspath(results_dir) if results_dir else None
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.debounce_seconds = debounce_seconds
+        self.poll_interval = poll_interval
+        self.max_concurrency = max_concurrency
+        self.retry_seconds = retry_seconds
+        self.max_retries = max_retries
+        self.save_interval = save_interval
+        self.state_path = os.path.join(self.results_dir or self.directory, STATE_FILENAME)
+
+        self._state = {}
+        self._state_changed = False
+        self._last_save = 0.0
+        self._pending = {}
+        self._retries = {}
+        self._in_flight = set()
+        self._snapshot = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self._observer = None
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="watch-analysis")
+        self.stats = {"analyzed": 0, "unchanged": 0, "failed": 0}
+
+    def _is_candidate(self, path):
+        name = os.path.basename(path)
+        # Skip Excel lock files (~$Model.xlsx) and hidden temporary files
+        if name.startswith("~$") or name.startswith("."):
+            return False
+        if self.results_dir and os.path.abspath(path).startswith(self.results_dir + os.sep):
+            return False
+        return name.lower().endswith(self.extensions)
+
+    def _key(self, path):
+        return os.path.relpath(path, self.directory)
+
+    def _result_path(self, path):
+        if self.results_dir:
+            return os.path.join(self.results_dir, self._key(path) + RESULT_SUFFIX)
+        return path + RESULT_SUFFIX
+
+    def _is_analyzed(self, key, signature=None, content_hash=None):
+        """Whether the last analysis of this file succeeded and matches the given signature or hash"""
+        known = self._state.get(key)
+        if not known or known.get("status") != "ok":
+            return False
+        if signature is not None and known["signature"] != signature:
+            return False
+        return content_hash is None or known["hash"] == content_hash
+
+    def _load_state(self):
+        if os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, "r") as f:
+                    self._state = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error(f"Could not read watch state {self.state_path}: {e}")
+                self._state = {}
+
+    def _save_state(self):
+        """Write the state file if it changed since the last write"""
+        # One writer at a time, so an older snapshot never replaces a newer one
+        with self._save_lock:
+            with self._lock:
+                if not self._state_changed:
+                    return
+                data = json.dumps(self._state)
+                self._state_changed = False
+            self._last_save = time.monotonic()
+            directory = os.path.dirname(self.state_path)
+            tmp_path = None
+            try:
+                os.makedirs(directory, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(prefix=STATE_FILENAME + ".", suffix=".tmp", dir=directory)
+                with os.fdopen(fd, "w") as f:
+                    f.write(data)
+                os.replace(tmp_path, self.state_path)
+            except OSError as e:
+                logger.error(f"Could not write watch state {self.state_path}: {e}")
+                with self._lock:
+                    self._state_changed = True
+                if tmp_path and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def _scan(self):
+        """Stat every candidate file; returns {path: signature}"""
+        found = {}
+        stack = [self.directory]
+        while stack:
+            directory = stack.pop()
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.path != self.results_dir:
+                            stack.append(entry.path)
+                    elif self._is_candidate(entry.path):
+                        stat = entry.stat()
+                        found[entry.path] = [stat.st_size, stat.st_mtime_ns]
+                except OSError:
+                    continue
+        return found
+
+    def notify(self, path):
+        """Record that a file may have changed; it is analyzed once it has settled"""
+        if not self._is_candidate(path):
+            return
+        with self._lock:
+            self._pending[os.path.abspath(path)] = {"signature": None, "since": time.monotonic()}
+
+    def _poll_loop(self):
+        while not self._stop.wait(self.poll_interval):
+            current = self._scan()
+            for path, signature in current.items():
+                if self._snapshot.get(path) != signature:
+                    self.notify(path)
+            for path in set(self._snapshot) - set(current):
+                with self._lock:
+                    if self._state.pop(self._key(path), None) is not None:
+                        self._state_changed = True
+                    self._pending.pop(path, None)
+                    self._retries.pop(path, None)
+            self._snapshot = current
+
+    def _start_observer(self):
+        """Use filesystem events from watchdog when it is installed"""
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            return False
+
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_created(self, event):
+                if not event.is_directory:
+                    watcher.notify(event.src_path)
+
+            def on_modified(self, event):
+                if not event.is_directory:
+                    watcher.notify(event.src_path)
+
+            def on_moved(self, event):
+                if not event.is_directory:
+                    watcher.notify(event.dest_path)
+
+        self._observer = Observer()
+        self._observer.schedule(Handler(), self.directory, recursive=True)
+        self._observer.start()
+        return True
+
+    def _debounce_loop(self):
+        tick = min(0.5, self.debounce_seconds / 2) if self.debounce_seconds else 0.1
+        while not self._stop.wait(tick):
+            now = time.monotonic()
+            ready = []
+            with self._lock:
+                for path, due in list(self._retries.items()):
+                    if due <= now:
+                        del self._retries[path]
+                        self._pending.setdefault(path, {"signature": None, "since": now})
+
+                for path, entry in list(self._pending.items()):
+                    if path in self._in_flight:
+                        continue
+                    try:
+                        signature = file_signature(path)
+                    except OSError:
+                        # Deleted or renamed away before it settled
+                        del self._pending[path]
+                        continue
+                    if signature != entry["signature"]:
+                        entry["signature"] = signature
+                        entry["since"] = now
+                    elif now - entry["since"] >= self.debounce_seconds:
+                        ready.append((path, signature))
+
+                for path, signature in ready:
+                    if len(self._in_flight) >= self.max_concurrency:
+                        break
+                    del self._pending[path]
+                    if self._is_analyzed(self._key(path), signature=signature):
+                        continue
+                    self._in_flight.add(path)
+                    self._executor.submit(self._process, path, signature)
+
+            if now - self._last_save >= self.save_interval:
+                self._save_state()
+
+    def _process(self, path, signature):
+        key = self._key(path)
+        try:
+            if not is_complete_workbook(path):
+                logger.warning(f"Skipping {key}: not a complete workbook")
+                return
+
+            content_hash = file_hash(path)
+            with self._lock:
+                known = self._state.get(key)
+                unchanged = self._is_analyzed(key, content_hash=content_hash)
+                if unchanged:
+                    # Touched or re-saved without changes
+                    known["signature"] = signature
+                    self._state_changed = True
+                    self.stats["unchanged"] += 1
+            if unchanged:
+                return
+
+            logger.info(f"Analyzing {key}")
+            entry = {"signature": signature, "hash": content_hash}
+            try:
+                results = self.analyze(path)
+            except Exception as e:
+                logger.error(f"Error analyzing {key}: {e}", exc_info=True)
+                entry["status"] = "error"
+                entry["error"] = str(e)
+                # Failures of the same contents count towards the retry limit
+                previous = known.get("attempts", 0) if known and known["hash"] == content_hash else 0
+                entry["attempts"] = previous + 1
+                with self._lock:
+                    self.stats["failed"] += 1
+                    if entry["attempts"] < self.max_retries:
+                        delay = self.retry_seconds * 2 ** (entry["attempts"] - 1)
+                        self._retries[path] = time.monotonic() + delay
+                        logger.info(f"Retrying {key} in {delay:.1f}s (attempt {entry['attempts']} failed)")
+            else:
+                result_path = self._result_path(path)
+                os.makedirs(os.path.dirname(result_path), exist_ok=True)
+                tmp_path = result_path + ".tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(results, f, indent=2, default=str)
+                os.replace(tmp_path, result_path)
+                entry["status"] = "ok"
+                entry["result"] = result_path
+                with self._lock:
+                    self.stats["analyzed"] += 1
+                logger.info(f"Wrote {result_path}")
+
+            with self._lock:
+                self._state[key] = entry
+                self._state_changed = True
+        except Exception as e:
+            logger.error(f"Error processing {key}: {e}", exc_info=True)
+        finally:
+            with self._lock:
+                self._in_flight.discard(path)
+
+    def start(self):
+        """Queue files changed since the last run and start watching"""
+        self._load_state()
+        self._snapshot = self._scan()
+        for path, signature in self._snapshot.items():
+            # Includes files whose last analysis failed
+            if not self._is_analyzed(self._key(path), signature=signature):
+                self.notify(path)
+
+        if not self._start_observer():
+            self._threads.append(threading.Thread(target=self._poll_loop, name="watch-poll", daemon=True))
+        self._threads.append(threading.Thread(target=self._debounce_loop, name="watch-debounce", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Stop watching and wait for running analyses to finish"""
+        self._stop.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+        for thread in self._threads:
+            thread.join()
+        self._executor.shutdown(wait=True)
+        self._save_state()
+
+    def run_forever(self, status_interval=60.0):
+        """Watch until interrupted with Ctrl+C"""
+        self.start()
+        try:
+            while not self._stop.wait(status_interval):
+                with self._lock:
+                    logger.info(f"Watching {self.directory}: {len(self._pending)} pending, "
+                                f"{len(self._in_flight)} running, {len(self._retries)} awaiting retry, "
+                                f"{self.stats}")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
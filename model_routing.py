@@ -0,0 +1,362 @@
+import time
+import random
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+logger = logging.getLogger(__name__)
+
+# Fastest first; a workbook starts at the first tier whose max_cells it fits under
+DEFAULT_MODEL_TIERS = [
+    ("gemini-2.0-flash-lite", 2000),
+    ("gemini-2.0-flash", 50000),
+    ("gemini-2.5-flash", None),
+]
+
+RETURN_METRIC_KEYS = ("npv", "irr", "payback_period", "roi", "profit_margin")
+
+# How often a request waiting in the scheduler queue is checked before hedging is considered
+DISPATCH_POLL_SECONDS = 0.25
+
+
+class ResponseFormatError(Exception):
+    """A model answered, but not with parseable analysis JSON; the router escalates instead of failing"""
+
+
+class ModelTier:
+    """A model and the largest workbook (in extracted cells) that should start on it"""
+
+    def __init__(self, model, max_cells=None):
+        self.model = model
+        self.max_cells = max_cells
+
+    def __repr__(self):
+        return f"ModelTier({self.model!r}, max_cells={self.max_cells})"
+
+
+def parse_model_tiers(text):
+    """Parse 'model:max_cells, model:max_cells, model' as written in the [Models] config section"""
+    tiers = []
+    for entry in text.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        model, _, max_cells = entry.partition(":")
+        tiers.append(ModelTier(model.strip(), int(max_cells) if max_cells.strip() else None))
+    return tiers
+
+
+def validate_analysis(results):
+    """
+    Check an analysis for missing or inconsistent sections
+
+    Returns:
+        List of problem descriptions; empty when the analysis looks complete
+    """
+    if not isinstance(results, dict):
+        return ["analysis is not a JSON object"]
+
+    problems = []
+    assumptions = results.get("assumptions")
+    if not isinstance(assumptions, list) or not assumptions:
+        problems.append("no assumptions")
+    elif any(not isinstance(a, dict) or "description" not in a or "value" not in a for a in assumptions):
+        problems.append("assumptions without description or value")
+
+    returns = results.get("financial_returns")
+    if not isinstance(returns, dict):
+        problems.append("no financial returns")
+    else:
+        found = [returns.get(key) for key in RETURN_METRIC_KEYS if isinstance(returns.get(key), dict)]
+        if not found and not returns.get("other_metrics"):
+            problems.append("no financial returns")
+        elif any("value" not in metric for metric in found):
+            problems.append("financial returns without values")
+
+    cash_flows = results.get("cash_flows")
+    if not isinstance(cash_flows, list) or not cash_flows:
+        problems.append("no cash flows")
+    elif all(not isinstance(cf, dict) or not cf.get("periods") for cf in cash_flows):
+        problems.append("cash flows without periods")
+
+    if not results.get("summary"):
+        problems.append("no summary")
+    return problems
+
+
+class RequestTiming:
+    """
+    Lets a call tell the router when its request actually went out
+
+    A call that goes through a RequestScheduler passes its ScheduledFuture to track(); one that
+    sends straight away calls dispatched(). Latency is measured from that moment, so time spent
+    waiting for quota is not counted against the model. Calls that report neither are timed
+    from when they started and are never hedged.
+    """
+
+    def __init__(self):
+        self.future = None
+        self._dispatched_at = None
+
+    def track(self, future):
+        self.future = future
+
+    def dispatched(self):
+        self._dispatched_at = time.monotonic()
+
+    @property
+    def dispatched_at(self):
+        if self.future is not None:
+            return self.future.dispatched_at
+        return self._dispatched_at
+
+    @property
+    def in_flight(self):
+        """Whether the request has been sent and not yet answered or requeued"""
+        if self.future is not None:
+            return not self.future.queued and self.future.dispatched_at is not None and not self.future.done()
+        return self._dispatched_at is not None
+
+
+class ModelRouter:
+    """
+    Routes each analysis to the fastest model tier likely to handle it.
+
+    Small workbooks start on the fastest tier and escalate to the next one only when
+    validate_analysis() finds problems. Per-tier latency and validation success are recorded:
+    a tier that keeps failing validation is skipped as a starting point, and with
+    hedge_percentile set a duplicate request is sent once the first one has been in flight
+    longer than that latency percentile for its model. With a scheduler, hedges are only
+    sent when its request quota has room to spare.
+    """
+
+    def __init__(self, tiers=None, hedge_percentile=None, min_samples=20, window=100, max_workers=8,
+                 scheduler=None):
+        self.tiers = tiers or [ModelTier(model, max_cells) for model, max_cells in DEFAULT_MODEL_TIERS]
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self.scheduler = scheduler
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model-router")
+        self._stats = {}
+        for tier in self.tiers:
+            self._stats[tier.model] = {
+                "latencies": deque(maxlen=window),
+                "outcomes": deque(maxlen=window),
+                "requests": 0,
+                "errors": 0,
+                "escalations": 0,
+                "hedges": 0,
+                "hedge_wins": 0,
+                "skipped": 0,
+            }
+
+    def _percentile(self, model, percentile):
+        latencies = sorted(self._stats[model]["latencies"])
+        if len(latencies) < self.min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))]
+
+    def choose_tier(self, workbook_cells):
+        """Index of the tier a workbook of this size starts on"""
+        index = len(self.tiers) - 1
+        for i, tier in enumerate(self.tiers):
+            if tier.max_cells is None or workbook_cells <= tier.max_cells:
+                index = i
+                break
+
+        # Skip tiers whose recent results mostly failed validation, probing them again now and then
+        with self._lock:
+            while index < len(self.tiers) - 1:
+                stats = self._stats[self.tiers[index].model]
+                outcomes = stats["outcomes"]
+                if len(outcomes) < self.min_samples or sum(outcomes) / len(outcomes) >= 0.5:
+                    break
+                stats["skipped"] += 1
+                if stats["skipped"] % self.min_samples == 0:
+                    break
+                index += 1
+        return index
+
+    def _record(self, model, **counters):
+        with self._lock:
+            stats = self._stats[model]
+            for key, value in counters.items():
+                if key in ("latencies", "outcomes"):
+                    stats[key].append(value)
+                else:
+                    stats[key] += value
+
+    def _call_with_hedge(self, call, model):
+        """Call the model, sending a hedged duplicate if the first request runs unusually long"""
+        with self._lock:
+            threshold = self._percentile(model, self.hedge_percentile) if self.hedge_percentile else None
+
+        start = time.monotonic()
+        timing = RequestTiming()
+        primary = self._executor.submit(call, model, timing)
+        self._record(model, requests=1)
+        timings = {primary: timing}
+        hedge = None
+        pending = {primary}
+
+        def record_latency(future):
+            if not future.cancelled() and future.exception() is None:
+                self._record(model, latencies=time.monotonic() - (timings[future].dispatched_at or start))
+        while True:
+            timeout = None
+            if threshold is not None and hedge is None:
+                if not timing.in_flight:
+                    # Waiting for quota (or retrying after a 429) is not slowness of the model
+                    timeout = DISPATCH_POLL_SECONDS
+                else:
+                    timeout = timing.dispatched_at + threshold - time.monotonic()
+                    if timeout <= 0:
+                        if self.scheduler is None or self.scheduler.has_spare_capacity():
+                            logger.info(f"{model} slower than p{self.hedge_percentile} ({threshold:.1f}s), "
+                                        f"sending hedged request")
+                            hedge_timing = RequestTiming()
+                            hedge = self._executor.submit(call, model, hedge_timing)
+                            timings[hedge] = hedge_timing
+                            self._record(model, requests=1, hedges=1)
+                            pending.add(hedge)
+                            timeout = None
+                        else:
+                            timeout = DISPATCH_POLL_SECONDS
+
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in sorted(done, key=lambda f: f.exception() is not None):
+                if future.exception() is None or not pending:
+                    record_latency(future)
+                    if future is hedge:
+                        self._record(model, hedge_wins=1)
+                    # The slower duplicate is left to finish in the background. Its latency still
+                    # counts, or the percentiles behind the hedge threshold would drift down
+                    for other in pending:
+                        other.add_done_callback(record_latency)
+                    return future.result()
+
+    def run(self, call, workbook_cells, progress_callback=None, validate=validate_analysis, escalate=True):
+        """
+        Analyze with the starting tier for this workbook, escalating while validation fails
+
+        Args:
+            call: Function taking a model name and a RequestTiming and returning the parsed analysis
+            workbook_cells: Number of cells extracted from the workbook
+            progress_callback: Callback function to update progress
+            validate: Function returning the list of problems in a result, as validate_analysis() does
+            escalate: Whether to try larger tiers when validation fails; if not, the starting
+                tier's result is returned as it is and the caller handles its problems
+
+        Returns:
+            The first analysis that passes validation, otherwise the one with fewest problems
+
+        Raises:
+            ResponseFormatError: If no tier returned a parseable analysis
+        """
+        best = None
+        best_problems = None
+        format_error = None
+        start_index = self.choose_tier(workbook_cells)
+        end_index = len(self.tiers) if escalate else start_index + 1
+        for index in range(start_index, end_index):
+            model = self.tiers[index].model
+            if progress_callback:
+                progress_callback(f"Processing with Gemini AI model {model}...")
+
+            try:
+                results = self._call_with_hedge(call, model)
+                problems = validate(results)
+            except ResponseFormatError as e:
+                # Malformed output is how fast models usually fail; a larger one may well succeed
+                format_error = e
+                results, problems = None, [str(e)]
+            except Exception:
+                # Transport, quota and authentication errors would fail on every tier
+                self._record(model, errors=1)
+                raise
+
+            self._record(model, outcomes=0 if problems else 1)
+            if not problems:
+                return results
+
+            if results is not None and (best is None or len(problems) < len(best_problems)):
+                best, best_problems = results, problems
+            if index < end_index - 1:
+                self._record(model, escalations=1)
+                logger.info(f"{model} analysis incomplete ({', '.join(problems)}), escalating")
+                if progress_callback:
+                    progress_callback(f"Analysis incomplete ({', '.join(problems)}), retrying with a larger model...")
+        if best is None:
+            raise format_error
+        return best
+
+    def stats(self):
+        """Per-model request counts, validation success rate and latency percentiles"""
+        with self._lock:
+            report = {}
+            for model, stats in self._stats.items():
+                latencies = sorted(stats["latencies"])
+                outcomes = stats["outcomes"]
+                report[model] = {
+                    "requests": stats["requests"],
+                    "errors": stats["errors"],
+                    "escalations": stats["escalations"],
+                    "hedges": stats["hedges"],
+                    "hedge_wins": stats["hedge_wins"],
+                    "skipped": stats["skipped"],
+                    "success_rate": round(sum(outcomes) / len(outcomes), 3) if outcomes else None,
+                    "p50_seconds": round(latencies[len(latencies) // 2], 3) if latencies else None,
+                    "p95_seconds": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3)
+                    if latencies else None,
+                }
+            return report
+
+
+class SimulatedModels:
+    """
+    Local stand-in for the Gemini API with per-model speed and completeness
+
+    Pass an instance as the `call` argument of ModelRouter.run() to exercise routing,
+    escalation and hedging without network access or quota. Requests count as dispatched
+    as soon as they are called.
+
+    Args:
+        latencies: Mapping of model name to typical response time in seconds
+        incomplete: Model names whose analyses leave out the cash flow section
+        slow_rate: Fraction of requests that hit a tail latency of slow_factor times normal
+        seed: Seed for the random tail, for repeatable runs
+    """
+
+    SAMPLE_ANALYSIS = {
+        "assumptions": [{"description": "Discount Rate", "value": "12.0%"}],
+        "financial_returns": {
+            "npv": {"label": "Net Present Value (NPV)", "value": "$-419,141.78"},
+            "irr": {"label": "Internal Rate of Return (IRR)", "value": "-2.82%"},
+            "other_metrics": [],
+        },
+        "cash_flows": [{"label": "Net Cash Flow", "periods": [{"period": "Year 0", "value": "$-1,000,000"}]}],
+        "summary": "Simulated analysis.",
+    }
+
+    def __init__(self, latencies, incomplete=(), slow_rate=0.0, slow_factor=10.0, seed=None):
+        self.latencies = latencies
+        self.incomplete = set(incomplete)
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+        self.calls = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __call__(self, model, timing=None):
+        if timing is not None:
+            timing.dispatched()
+        with self._lock:
+            self.calls.append(model)
+            slow = self._random.random() < self.slow_rate
+        time.sleep(self.latencies.get(model, 1.0) * (self.slow_factor if slow else 1.0))
+        results = dict(self.SAMPLE_ANALYSIS, model=model)
+        if model in self.incomplete:
+            results["cash_flows"] = []
+        return results
@@ -0,0 +1,294 @@
+import re
+import math
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Lower numbers are dispatched first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+# Gemini tokenizes English and JSON at roughly four characters per token
+CHARS_PER_TOKEN = 4
+
+
+class RateLimitError(Exception):
+    """Raised by a request callable when the API answers 429 so the scheduler can retry it"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def estimate_text_tokens(text):
+    """Estimate the tokens in a piece of prompt text"""
+    return max(1, math.ceil(len(text) / CHARS_PER_TOKEN))
+
+
+def estimate_request_tokens(payload):
+    """Estimate the input tokens of a generateContent payload from the length of its text parts"""
+    chars = 0
+    for content in payload.get("contents", []):
+        for part in content.get("parts", []):
+            chars += len(part.get("text", ""))
+    return max(1, math.ceil(chars / CHARS_PER_TOKEN))
+
+
+def retry_after_from_response(response):
+    """Read the suggested retry delay in seconds from a 429 response, if the API sent one"""
+    header = response.headers.get("Retry-After")
+    if header:
+        try:
+            return float(header)
+        except ValueError:
+            pass
+    # Gemini reports it as RetryInfo.retryDelay, e.g. "37s"
+    match = re.search(r'"retryDelay"\s*:\s*"(\d+(?:\.\d+)?)s"', response.text or "")
+    return float(match.group(1)) if match else None
+
+
+class SlidingWindow:
+    """
+    Usage over the last minute, as the API counts it; not thread-safe, the scheduler holds the lock
+
+    A refilling bucket that starts full lets through its capacity on top of the refill rate,
+    nearly twice the quota in the first minute. Keeping the log of what was sent in the last
+    60 seconds admits a request only when it fits under the limit for every 60 second span.
+    """
+
+    def __init__(self, limit, period=60.0):
+        self.limit = limit
+        self.period = period
+        self.total = 0
+        self._entries = deque()
+
+    def _expire(self, now):
+        while self._entries and self._entries[0][0] <= now - self.period:
+            self.total -= self._entries.popleft()[1]
+
+    def time_until(self, amount, now):
+        """Seconds until `amount` more fits in the window"""
+        self._expire(now)
+        excess = self.total + amount - self.limit
+        if excess <= 0:
+            return 0.0
+        for timestamp, used in self._entries:
+            excess -= used
+            if excess <= 0:
+                return timestamp + self.period - now
+        return self.period
+
+    def consume(self, amount, now):
+        self._expire(now)
+        self._entries.append((now, amount))
+        self.total += amount
+
+
+class ScheduledFuture(Future):
+    """
+    Future of a scheduled request
+
+    `queued` is True while it waits for quota or a retry; `dispatched_at` is the
+    time.monotonic() at which it was last sent, or None before that.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.queued = True
+        self.dispatched_at = None
+
+
+class _Job:
+    def __init__(self, send, tokens, priority, sequence):
+        self.send = send
+        self.tokens = tokens
+        self.priority = priority
+        self.sequence = sequence
+        self.future = ScheduledFuture()
+        self.submitted = time.monotonic()
+        self.not_before = 0.0
+        self.attempts = 0
+
+
+class RequestScheduler:
+    """
+    Dispatches API requests within per-minute request (RPM) and token (TPM) quotas.
+
+    Jobs are queued by priority, so interactive requests overtake queued batch work, and are only
+    released once both sliding windows can admit them. A 429 pauses dispatching for the delay the
+    API suggests and requeues the job instead of failing it.
+    """
+
+    def __init__(self, requests_per_minute=15, tokens_per_minute=1000000, max_concurrency=4, max_retries=3):
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self._requests = SlidingWindow(requests_per_minute)
+        self._tokens = SlidingWindow(tokens_per_minute)
+        self._queue = []
+        self._sequence = 0
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="gemini-request")
+        self._stats = {"completed": 0, "failed": 0, "rate_limited": 0, "retried": 0}
+        self._wait_times = {}
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="gemini-scheduler", daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, send, tokens, priority=PRIORITY_BATCH):
+        """
+        Queue a request
+
+        Args:
+            send: Callable performing the request; raise RateLimitError on HTTP 429
+            tokens: Estimated input tokens of the request
+            priority: PRIORITY_INTERACTIVE or PRIORITY_BATCH (lower runs first)
+
+        Returns:
+            ScheduledFuture resolving to the return value of `send`
+        """
+        with self._condition:
+            self._sequence += 1
+            job = _Job(send, tokens, priority, self._sequence)
+            self._queue.append(job)
+            self._condition.notify_all()
+        return job.future
+
+    def record_usage(self, estimated_tokens, actual_tokens):
+        """Correct the token window once the API reports how many tokens a request really used"""
+        if actual_tokens is None:
+            return
+        with self._condition:
+            self._tokens.consume(actual_tokens - estimated_tokens, time.monotonic())
+
+    def stats(self):
+        """Queue depth, in-flight requests, outcome counters and wait times per priority"""
+        with self._condition:
+            waits = {}
+            for priority, samples in self._wait_times.items():
+                waits[priority] = {
+                    "count": len(samples),
+                    "average_seconds": round(sum(samples) / len(samples), 3),
+                    "max_seconds": round(max(samples), 3),
+                }
+            return {
+                "queue_depth": len(self._queue),
+                "in_flight": self._in_flight,
+                "paused_seconds": round(max(0.0, self._paused_until - time.monotonic()), 3),
+                "wait_times": waits,
+                **self._stats,
+            }
+
+    def has_spare_capacity(self, requests=1):
+        """Whether `requests` more could be sent right now on top of everything already queued"""
+        with self._condition:
+            now = time.monotonic()
+            if self._closed or self._paused_until > now or self._in_flight >= self.max_concurrency:
+                return False
+            return self._requests.time_until(len(self._queue) + requests, now) == 0
+
+    def shutdown(self, wait=True):
+        """Stop dispatching; queued jobs are cancelled, in-flight requests finish"""
+        with self._condition:
+            self._closed = True
+            for job in self._queue:
+                if not job.future.cancel():
+                    job.future.set_exception(RuntimeError("Request scheduler was shut down"))
+            self._queue.clear()
+            self._condition.notify_all()
+        self._dispatcher.join()
+        self._executor.shutdown(wait=wait)
+
+    def _next_job(self, now):
+        """
+        Highest-priority, oldest job that is not backing off
+
+        Returns:
+            (job or None, seconds until the next backing-off job becomes ready or None)
+        """
+        ready = [job for job in self._queue if job.not_before <= now]
+        backing_off = [job.not_before - now for job in self._queue if job.not_before > now]
+        job = min(ready, key=lambda job: (job.priority, job.sequence)) if ready else None
+        return job, min(backing_off) if backing_off else None
+
+    def _dispatch_loop(self):
+        with self._condition:
+            while True:
+                if self._closed:
+                    return
+                if not self._queue or self._in_flight >= self.max_concurrency:
+                    self._condition.wait()
+                    continue
+
+                now = time.monotonic()
+                job, next_ready = self._next_job(now)
+                if job is None:
+                    wait = next_ready
+                else:
+                    # A request larger than the whole quota is let through once the window is empty
+                    tokens = min(job.tokens, self._tokens.limit)
+                    wait = max(self._paused_until - now,
+                               self._requests.time_until(1, now),
+                               self._tokens.time_until(tokens, now))
+                    if wait > 0 and next_ready is not None:
+                        # Re-evaluate when a retried job comes off backoff; it may outrank this one
+                        wait = min(wait, next_ready)
+                if wait > 0:
+                    # Wake early if a higher-priority job arrives or a request finishes
+                    self._condition.wait(wait)
+                    continue
+
+                self._queue.remove(job)
+                if job.attempts == 0 and not job.future.set_running_or_notify_cancel():
+                    continue
+                self._requests.consume(1, now)
+                self._tokens.consume(job.tokens, now)
+                self._in_flight += 1
+                job.future.queued = False
+                job.future.dispatched_at = now
+                # Time since the job was queued or requeued after a 429, recorded once per dispatch
+                self._wait_times.setdefault(job.priority, deque(maxlen=1000)).append(now - job.submitted)
+                self._executor.submit(self._run, job)
+
+    def _run(self, job):
+        try:
+            result = job.send()
+        except RateLimitError as e:
+            with self._condition:
+                now = time.monotonic()
+                self._stats["rate_limited"] += 1
+                # Our estimate undershot the real quota; stop everyone until the API says it is safe
+                delay = e.retry_after if e.retry_after is not None else 2 ** job.attempts * 5
+                self._paused_until = max(self._paused_until, now + delay)
+                if job.attempts < self.max_retries and not self._closed:
+                    job.attempts += 1
+                    job.not_before = now + delay
+                    job.submitted = now
+                    job.future.queued = True
+                    self._stats["retried"] += 1
+                    self._queue.append(job)
+                    logger.warning(f"Rate limited by API, retrying in {delay:.1f}s (attempt {job.attempts})")
+                else:
+                    self._stats["failed"] += 1
+                    job.future.set_exception(e)
+                self._in_flight -= 1
+                self._condition.notify_all()
+            return
+        except Exception as e:
+            with self._condition:
+                self._stats["failed"] += 1
+                self._in_flight -= 1
+                self._condition.notify_all()
+            job.future.set_exception(e)
+            return
+
+        with self._condition:
+            self._stats["completed"] += 1
+            self._in_flight -= 1
+            self._condition.notify_all()
+        job.future.set_result(result)
@@ -0,0 +1,52 @@
+import copy
+import importlib.util
+import os
+
+import pytest
+
+from model_routing import ModelRouter, ModelTier, SimulatedModels
+
+MODULE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "financial-analyzer.py")
+
+
+@pytest.fixture
+def analyzer(tmp_path, monkeypatch):
+    # Keep the user's config file out of the tests
+    monkeypatch.setenv("HOME", str(tmp_path))
+    spec = importlib.util.spec_from_file_location("financial_analyzer", MODULE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def workbook(file_path):
+    """Extracted data of a small workbook: 60 cells"""
+    return {"filename": os.path.basename(file_path),
+            "sheets": [{"name": "Model", "data": [["Revenue", 100, 110]] * 20}]}
+
+
+def test_pack_keeps_complete_sections_and_retries_the_rest_alone(analyzer, monkeypatch):
+    router = ModelRouter([ModelTier("small", 100), ModelTier("medium", 1000), ModelTier("large")])
+    processor = analyzer.GeminiModelProcessor(api_key="test", router=router)
+    calls = []
+
+    def request_analysis(model, data, priority=None, progress_callback=None, timing=None):
+        text = data["contents"][0]["parts"][1]["text"]
+        packed = "workbook_1" in text
+        calls.append((model, packed))
+        analysis = copy.deepcopy(SimulatedModels.SAMPLE_ANALYSIS)
+        if not packed:
+            return analysis
+        # The second workbook's section comes back without cash flows
+        incomplete = dict(analysis, cash_flows=[])
+        return {"workbook_1": analysis, "workbook_2": incomplete, "workbook_3": analysis}
+
+    monkeypatch.setattr(processor, "_extract_and_prepare_data", workbook)
+    monkeypatch.setattr(processor, "_request_analysis", request_analysis)
+
+    results = processor.analyze_excel_files(["a.xlsx", "b.xlsx", "c.xlsx"])
+
+    # One pack request sized for all three workbooks, then only the failed one on its own
+    assert calls == [("medium", True), ("small", False)]
+    assert sorted(results) == ["a.xlsx", "b.xlsx", "c.xlsx"]
+    assert all(result["cash_flows"] for result in results.values())
@@ -0,0 +1,60 @@
+import json
+import os
+import threading
+import time
+
+from folder_watcher import STATE_FILENAME, FolderWatcher
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.02)
+
+
+def test_concurrent_saves_leave_a_complete_state_file(tmp_path):
+    watcher = FolderWatcher(tmp_path, analyze=lambda path: {})
+    errors = []
+
+    def worker(number):
+        try:
+            for i in range(200):
+                with watcher._lock:
+                    watcher._state[f"{number}/{i}.xlsx"] = {"status": "ok", "signature": [i, i], "hash": "x" * 64}
+                    watcher._state_changed = True
+                watcher._save_state()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    with open(tmp_path / STATE_FILENAME) as f:
+        assert len(json.load(f)) == 800
+    assert os.listdir(tmp_path) == [STATE_FILENAME]
+
+
+def test_state_is_written_in_batches_and_on_stop(tmp_path, monkeypatch):
+    for i in range(20):
+        (tmp_path / f"model_{i}.csv").write_text("Item,Amount\nRevenue,100\n")
+    writes = []
+    replace = os.replace
+    monkeypatch.setattr(os, "replace", lambda source, target: writes.append(target) or replace(source, target))
+    watcher = FolderWatcher(tmp_path, analyze=lambda path: {"ok": True}, results_dir=tmp_path / "results",
+                            extensions=(".csv",), debounce_seconds=0.05, max_concurrency=4, save_interval=3600)
+    watcher.start()
+    try:
+        wait_for(lambda: watcher.stats["analyzed"] == 20)
+    finally:
+        watcher.stop()
+
+    state_writes = [target for target in writes if target.endswith(STATE_FILENAME)]
+    # At most one write while analyzing, then the final one on stop
+    assert 1 <= len(state_writes) <= 2
+    with open(tmp_path / "results" / STATE_FILENAME) as f:
+        assert sorted(json.load(f)) == sorted(f"model_{i}.csv" for i in range(20))
@@ -0,0 +1,75 @@
+import time
+
+import pytest
+
+from model_routing import ModelRouter, ModelTier, ResponseFormatError, SimulatedModels
+
+TIERS = [ModelTier("small", 100), ModelTier("medium", 1000), ModelTier("large")]
+
+
+def test_malformed_response_escalates_to_next_tier():
+    router = ModelRouter(list(TIERS))
+    calls = []
+
+    def call(model, timing):
+        calls.append(model)
+        if model == "small":
+            raise ResponseFormatError("Error parsing Gemini response as JSON: Expecting value")
+        return dict(SimulatedModels.SAMPLE_ANALYSIS, model=model)
+
+    result = router.run(call, workbook_cells=50)
+
+    assert result["model"] == "medium"
+    assert calls == ["small", "medium"]
+    stats = router.stats()
+    assert stats["small"]["success_rate"] == 0.0
+    assert stats["small"]["escalations"] == 1
+    assert stats["small"]["errors"] == 0
+
+
+def test_format_error_on_every_tier_is_raised():
+    router = ModelRouter(list(TIERS))
+
+    def call(model, timing):
+        raise ResponseFormatError(f"No content returned from {model}")
+
+    with pytest.raises(ResponseFormatError, match="large"):
+        router.run(call, workbook_cells=50)
+
+
+def test_transport_error_is_not_escalated():
+    router = ModelRouter(list(TIERS))
+    calls = []
+
+    def call(model, timing):
+        calls.append(model)
+        raise Exception("Failed to communicate with Gemini API: connection reset")
+
+    with pytest.raises(Exception, match="communicate"):
+        router.run(call, workbook_cells=50)
+    assert calls == ["small"]
+    assert router.stats()["small"]["errors"] == 1
+
+
+def test_losing_primary_latency_is_recorded_when_hedge_wins():
+    router = ModelRouter([ModelTier("small")], hedge_percentile=50, min_samples=5)
+    for _ in range(5):
+        router._record("small", latencies=0.05)
+    calls = []
+
+    def call(model, timing):
+        timing.dispatched()
+        calls.append(model)
+        # The first request hits a slow tail; the hedge answers at once
+        time.sleep(0.5 if len(calls) == 1 else 0.0)
+        return dict(SimulatedModels.SAMPLE_ANALYSIS, model=model)
+
+    router.run(call, workbook_cells=50)
+    assert router.stats()["small"]["hedge_wins"] == 1
+
+    deadline = time.monotonic() + 5
+    while len(router._stats["small"]["latencies"]) < 7 and time.monotonic() < deadline:
+        time.sleep(0.02)
+    latencies = sorted(router._stats["small"]["latencies"])
+    assert len(latencies) == 7
+    assert latencies[-1] >= 0.4
@@ -0,0 +1,313 @@
+import html
+import re
+import zipfile
+
+import pytest
+
+import workbook_diff
+from workbook_readers import open_workbook
+
+MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml"
+
+# Cell styles: 0 general, 1 a built-in date format, 2 a custom date format, 3 percent
+STYLES = (
+    f'<styleSheet xmlns="{MAIN_NS}">'
+    '<numFmts count="1"><numFmt numFmtId="164" formatCode="dd/mm/yyyy;@"/></numFmts>'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="1"><fill><patternFill patternType="none"/></fill></fills>'
+    '<borders count="1"><border/></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="4"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="10" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+
+def prefixed(xml, prefix):
+    """Write the SpreadsheetML elements with a namespace prefix, as some producers do"""
+    if not prefix:
+        return xml
+    xml = re.sub(r'<(/?)(?![?!])(\w+)([ >/])', rf'<\1{prefix}:\2\3', xml)
+    return xml.replace(f'xmlns="{MAIN_NS}"', f'xmlns:{prefix}="{MAIN_NS}"')
+
+
+def write_xlsx(path, sheets, strings, prefix="", date1904=False):
+    """
+    Write an .xlsx package laid out the way Excel saves it
+
+    Args:
+        sheets: {sheet name: sheetData inner XML}
+        strings: Shared string items as <si> inner XML
+    """
+    names = list(sheets)
+    calendar = ' date1904="1"' if date1904 else ""
+    # Read-only openpyxl trusts the dimension, so it has to cover every cell as Excel's does
+    dimensions = {name: "A1:E%d" % max(map(int, re.findall(r'<row r="(\d+)"', xml))) for name, xml in sheets.items()}
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("[Content_Types].xml",
+                    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                    '<Default Extension="xml" ContentType="application/xml"/>'
+                    f'<Override PartName="/xl/workbook.xml" ContentType="{CONTENT_TYPE}.sheet.main+xml"/>' +
+                    "".join(f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+                            f'ContentType="{CONTENT_TYPE}.worksheet+xml"/>' for i in range(1, len(names) + 1)) +
+                    f'<Override PartName="/xl/sharedStrings.xml" ContentType="{CONTENT_TYPE}.sharedStrings+xml"/>'
+                    f'<Override PartName="/xl/styles.xml" ContentType="{CONTENT_TYPE}.styles+xml"/></Types>')
+        zf.writestr("_rels/.rels",
+                    f'<Relationships xmlns="{PKG_REL_NS}"><Relationship Id="rId1" Target="xl/workbook.xml" '
+                    f'Type="{REL_NS}/officeDocument"/></Relationships>')
+        zf.writestr("xl/workbook.xml",
+                    f'<workbook xmlns="{MAIN_NS}" xmlns:r="{REL_NS}">'
+                    f'<workbookPr{calendar} defaultThemeVersion="164011"/><sheets>' +
+                    "".join(f'<sheet name="{name}" sheetId="{i}" r:id="rId{i}"/>' for i, name in enumerate(names, 1)) +
+                    '</sheets></workbook>')
+        zf.writestr("xl/_rels/workbook.xml.rels",
+                    f'<Relationships xmlns="{PKG_REL_NS}">' +
+                    "".join(f'<Relationship Id="rId{i}" Target="worksheets/sheet{i}.xml" Type="{REL_NS}/worksheet"/>'
+                            for i in range(1, len(names) + 1)) +
+                    f'<Relationship Id="rId{len(names) + 1}" Target="sharedStrings.xml" Type="{REL_NS}/sharedStrings"/>'
+                    f'<Relationship Id="rId{len(names) + 2}" Target="styles.xml" Type="{REL_NS}/styles"/>'
+                    '</Relationships>')
+        zf.writestr("xl/styles.xml", STYLES)
+        zf.writestr("xl/sharedStrings.xml", prefixed(
+            f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\r\n<sst xmlns="{MAIN_NS}" '
+            f'count="{len(strings)}" uniqueCount="{len(strings)}">' +
+            "".join(f"<si>{item}</si>" for item in strings) + "</sst>", prefix))
+        for i, name in enumerate(names, 1):
+            zf.writestr(f"xl/worksheets/sheet{i}.xml", prefixed(
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\r\n'
+                f'<worksheet xmlns="{MAIN_NS}" xmlns:r="{REL_NS}" '
+                'xmlns:x14ac="http://schemas.microsoft.com/office/spreadsheetml/2009/9/ac">'
+                f'<dimension ref="{dimensions[name]}"/><sheetViews><sheetView workbookViewId="0"/></sheetViews>'
+                '<sheetFormatPr defaultRowHeight="15" x14ac:dyDescent="0.25"/>'
+                f'<sheetData>{sheets[name]}</sheetData>'
+                '<pageMargins left="0.7" right="0.7" top="0.75" bottom="0.75" header="0.3" footer="0.3"/>'
+                '<rowBreaks count="1" manualBreakCount="1"><brk id="6" max="16383" man="1"/></rowBreaks>'
+                '</worksheet>', prefix))
+    return str(path)
+
+
+def row(number, cells, attributes=' spans="1:4" x14ac:dyDescent="0.25"'):
+    return f'<row r="{number}"{attributes}>{cells}</row>'
+
+
+def text(value):
+    return f"<t>{html.escape(value)}</t>"
+
+
+EXCEL_STRINGS = [
+    text("Assumptions"),
+    # Rich text with a phonetic hint, which is not part of the value
+    '<r><rPr><b/><sz val="11"/><rFont val="Calibri"/></rPr><t>Net Present </t></r>'
+    '<r><rPr><sz val="11"/><rFont val="Calibri"/></rPr><t xml:space="preserve">Value (NPV)</t></r>'
+    '<rPh sb="0" eb="3"><t>ネット</t></rPh><phoneticPr fontId="1"/>',
+    text("Start Date"),
+    text("R&D spend"),
+    '<t xml:space="preserve">  Growth rate </t>',
+]
+
+EXCEL_SHEET = "".join([
+    row(1, '<c r="A1" t="s"><v>0</v></c><c r="B1" t="inlineStr"><is><t>Scenario &lt;base&gt;</t></is></c>'),
+    row(2, '<c r="A2" t="s"><v>2</v></c><c r="B2" s="1"><v>45292</v></c><c r="C2" s="2"><v>45322.5</v></c>'),
+    row(3, '<c r="A3" t="s"><v>3</v></c><c r="B3"><v>1500</v></c><c r="C3"><f t="shared" ref="C3:C6" si="0">'
+           'B3*2</f><v>3000</v></c><c r="D3" t="inlineStr"><is><r><t>Rich </t></r><r><rPr><i/></rPr>'
+           '<t>inline</t></r></is></c>'),
+    row(4, '<c r="A4" t="s"><v>4</v></c><c r="B4" s="3"><v>0.15</v></c><c r="C4"><f t="shared" si="0"/>'
+           '<v>0.3</v></c>'),
+    row(5, '<c r="B5" t="b"><v>1</v></c><c r="C5"><f t="shared" si="0"/><v>2</v></c>'
+           '<c r="D5" t="e"><f>1/0</f><v>#DIV/0!</v></c>'),
+    row(6, '<c r="B6"><v>1.2345678901234E-5</v></c><c r="C6"><f t="shared" si="0"/><v>2.4691357802468E-5</v></c>'),
+    row(7, '<c r="A7" t="s"><v>1</v></c><c r="B7" t="str"><f>TEXT(B3,"0")&amp;"k"</f><v>1500k</v></c>'),
+    row(9, '<c r="A9" s="3"/><c r="B9"><v>-42</v></c>', ' spans="1:2" ht="20" customHeight="1"'),
+])
+
+
+def package_rows(path, sheet_name):
+    """Decode every row of a sheet through the direct XML path, by row number"""
+    package = workbook_diff._XlsxPackage(path)
+    try:
+        sheet = package.worksheet(sheet_name)
+        rows = {}
+        for chunk in sheet.chunks():
+            parsed = sheet.parse_chunk(chunk)
+            if parsed is not None:
+                rows[parsed[0]] = workbook_diff._decode_row(parsed[1], parsed[0], package, sheet)
+        return rows
+    finally:
+        package.close()
+
+
+def reader_rows(path, sheet_name):
+    """Rows as openpyxl reads them, by row number"""
+    with open_workbook(path, formulas=True, backend="openpyxl") as reader:
+        rows = workbook_diff._read_sheet_rows(reader, sheet_name)
+    return {i + 1: values for i, values in enumerate(rows) if values != ((), ())}
+
+
+def empty_report():
+    return {
+        "sheets_added": [], "sheets_removed": [], "sheets_unchanged": [], "changed_inputs": [],
+        "changed_formulas": [], "moved_values": [], "moved_rows": [], "return_metrics": [],
+        "stats": {"sheets_skipped": 0, "rows_skipped": 0, "rows_compared": 0},
+    }
+
+
+@pytest.mark.parametrize("prefix", ["", "x"])
+@pytest.mark.parametrize("date1904", [False, True])
+def test_decoded_rows_match_openpyxl(tmp_path, prefix, date1904):
+    path = write_xlsx(tmp_path / "model.xlsx", {"Inputs": EXCEL_SHEET}, EXCEL_STRINGS, prefix, date1904)
+
+    rows = package_rows(path, "Inputs")
+
+    assert rows == reader_rows(path, "Inputs")
+    assert rows[1][0] == ("Assumptions", "Scenario <base>")
+    assert rows[3][0][3] == "Rich inline"
+    assert rows[4][1][2] == "=B4*2"
+    assert rows[7][0][0] == "Net Present Value (NPV)"
+    assert rows[2][0][1].year == (2028 if date1904 else 2024)
+
+
+@pytest.mark.parametrize("prefix", ["", "x"])
+def test_metric_found_in_rich_text_label(tmp_path, prefix):
+    old = write_xlsx(tmp_path / "v1.xlsx", {"Inputs": EXCEL_SHEET}, EXCEL_STRINGS, prefix)
+    new_sheet = EXCEL_SHEET.replace('<c r="B3"><v>1500</v></c>', '<c r="B3"><v>1750</v></c>')
+    new = write_xlsx(tmp_path / "v2.xlsx", {"Inputs": new_sheet}, EXCEL_STRINGS, prefix)
+
+    report = workbook_diff.diff_workbooks(old, new)
+
+    assert report["changed_inputs"] == [
+        {"location": "Inputs!B3", "label": "R&D spend", "old": 1500, "new": 1750}]
+    assert report["changed_formulas"] == []
+    assert [metric["label"] for metric in report["return_metrics"]] == ["Net Present Value (NPV)"]
+
+
+def cash_flow_model(rows, inserted_at=None, edited=None, master="SUM(B{r}:D{r})"):
+    """
+    A sheet of labelled rows with a shared SUM formula, and its shared strings in first-use order
+
+    Args:
+        inserted_at: Index of a new row inserted before the others, shifting them down
+        edited: Index of a row whose first number is raised by 1000
+    """
+    strings = ["Item", "Amount"]
+    lines = ['<row r="1" spans="1:5"><c r="A1" t="s"><v>0</v></c><c r="B1" t="s"><v>1</v></c></row>']
+    numbers = [(i * 7 % 50 * 100, i * 13 % 30 * 10, i * 3 % 20) for i in range(rows)]
+    labels = [f"Line item {i}" for i in range(rows)]
+    if inserted_at is not None:
+        numbers.insert(inserted_at, (5,))
+        labels.insert(inserted_at, "Inserted line item")
+    for i, (label, values) in enumerate(zip(labels, numbers)):
+        r = i + 2
+        if i == edited:
+            values = (values[0] + 1000,) + values[1:]
+        if label not in strings:
+            strings.append(label)
+        cells = f'<c r="A{r}" t="s"><v>{strings.index(label)}</v></c>'
+        cells += "".join(f'<c r="{column}{r}"><v>{value}</v></c>' for column, value in zip("BCD", values))
+        if i == 0:
+            formula = f'<f t="shared" ref="E2:E{len(labels) + 1}" si="0">{master.format(r=r)}</f>'
+        else:
+            formula = '<f t="shared" si="0"/>'
+        cells += f'<c r="E{r}">{formula}<v>{sum(values)}</v></c>'
+        lines.append(row(r, cells))
+    return {"Cash Flows": "".join(lines)}, [text(value) for value in strings]
+
+
+def test_row_inserted_near_top_is_one_change(tmp_path):
+    old = write_xlsx(tmp_path / "v1.xlsx", *cash_flow_model(200))
+    new = write_xlsx(tmp_path / "v2.xlsx", *cash_flow_model(200, inserted_at=3, edited=150))
+
+    report = workbook_diff.diff_workbooks(old, new)
+
+    assert report["changed_inputs"] == [
+        {"location": "Cash Flows!B5", "label": "Inserted line item", "old": None, "new": 5},
+        {"location": "Cash Flows!B152", "label": "Line item 149", "old": 4300, "new": 5300},
+    ]
+    assert [change["location"] for change in report["changed_formulas"]] == ["Cash Flows!E5"]
+    assert report["moved_values"] == []
+    assert report["moved_rows"] == [{"sheet": "Cash Flows", "from_rows": "5-201", "to_rows": "6-202"}]
+    # Only the formula master whose range grew, the inserted row and the edited row are decoded
+    assert report["stats"]["rows_compared"] == 4
+
+
+def test_reordered_shared_strings_are_not_a_change(tmp_path):
+    sheets, strings = cash_flow_model(50)
+    old = write_xlsx(tmp_path / "v1.xlsx", sheets, strings)
+    order = list(reversed(range(len(strings))))
+    renumbered = re.sub(r'(t="s"><v>)(\d+)<', lambda m: f"{m.group(1)}{order[int(m.group(2))]}<",
+                        sheets["Cash Flows"])
+    new = write_xlsx(tmp_path / "v2.xlsx", {"Cash Flows": renumbered}, list(reversed(strings)))
+
+    report = workbook_diff.diff_workbooks(old, new)
+
+    assert report["sheets_unchanged"] == ["Cash Flows"]
+    assert report["changed_inputs"] == report["changed_formulas"] == report["moved_rows"] == []
+
+
+def test_edited_shared_formula_master_changes_every_member(tmp_path):
+    old = write_xlsx(tmp_path / "v1.xlsx", *cash_flow_model(20))
+    new = write_xlsx(tmp_path / "v2.xlsx", *cash_flow_model(20, master="SUM(B{r}:C{r})"))
+
+    report = workbook_diff.diff_workbooks(old, new)
+
+    changed = report["changed_formulas"]
+    assert [change["location"] for change in changed] == [f"Cash Flows!E{r}" for r in range(2, 22)]
+    assert changed[5]["old_formula"] == "=SUM(B7:D7)"
+    assert changed[5]["new_formula"] == "=SUM(B7:C7)"
+
+
+def test_switch_to_1904_date_system_changes_dates(tmp_path):
+    sheet = row(1, '<c r="A1" t="s"><v>0</v></c><c r="B1" s="1"><v>45292</v></c>')
+    old = write_xlsx(tmp_path / "v1.xlsx", {"Inputs": sheet}, [text("Start Date")])
+    new = write_xlsx(tmp_path / "v2.xlsx", {"Inputs": sheet}, [text("Start Date")], date1904=True)
+
+    report = workbook_diff.diff_workbooks(old, new)
+
+    assert [(change["old"].year, change["new"].year) for change in report["changed_inputs"]] == [(2024, 2028)]
+    assert report["sheets_unchanged"] == []
+
+
+def test_row_key_keeps_number_other_attributes_end_in():
+    sheet = workbook_diff._Worksheet(f'<worksheet xmlns="{MAIN_NS}"><sheetData/></worksheet>'.encode())
+
+    assert sheet.row_key(b'<row r="12" spans="1:12"><c r="A12"><v>12</v></c>') == (
+        12, b'<row r="" spans="1:12"><c r="A"><v>12</v></c>')
+    styled = b'<row r="12"><c r="A12" s="12"><v>3</v></c>'
+    assert sheet.row_key(styled) == (12, styled)
+    assert sheet.row_key(b'<row r="3"/>') is None
+
+
+def test_reader_rows_with_formulas_match_after_insert(tmp_path):
+    old = write_xlsx(tmp_path / "v1.xlsx", *cash_flow_model(30))
+    new = write_xlsx(tmp_path / "v2.xlsx", *cash_flow_model(30, inserted_at=3))
+    report = empty_report()
+
+    with open_workbook(old, formulas=True, backend="openpyxl") as old_reader, \
+            open_workbook(new, formulas=True, backend="openpyxl") as new_reader:
+        workbook_diff._compare_readers(old_reader, new_reader, report)
+
+    assert report["moved_rows"] == [{"sheet": "Cash Flows", "from_rows": "5-31", "to_rows": "6-32"}]
+    assert [change["location"] for change in report["changed_formulas"]] == ["Cash Flows!E5"]
+    assert [change["location"] for change in report["changed_inputs"]] == ["Cash Flows!B5"]
+
+
+def test_csv_reader_path(tmp_path):
+    # A CSV file's only sheet is named after the file
+    (tmp_path / "v1").mkdir()
+    (tmp_path / "v2").mkdir()
+    old = tmp_path / "v1" / "model.csv"
+    new = tmp_path / "v2" / "model.csv"
+    old.write_text("Item,Amount\nRevenue,100\nCosts,40\nNet Present Value (NPV),60\n")
+    new.write_text("Item,Amount\nRevenue,100\nTax,5\nCosts,45\nNet Present Value (NPV),50\n")
+
+    report = workbook_diff.diff_workbooks(str(old), str(new))
+
+    assert [(change["label"], change["old"], change["new"]) for change in report["changed_inputs"]] == [
+        ("Tax", None, 5), ("Costs", 40, 45), ("Net Present Value (NPV)", 60, 50)]
+    assert report["return_metrics"][0]["delta"] == -10
@@ -0,0 +1,22 @@
+import datetime
+import json
+
+from workbook_readers import open_workbook
+
+
+def test_csv_converts_only_finite_decimal_numbers(tmp_path):
+    path = tmp_path / "model.csv"
+    path.write_text("12,-3.5,.5,1e3, 7 ,+4\n"
+                    "NaN,inf,-Infinity,1_000,1e400,0x1F\n"
+                    "2024-01-31,Revenue,12%\n")
+
+    with open_workbook(str(path)) as reader:
+        cells = {(cell.row, cell.column): cell for cell in reader.iter_sheet("model")}
+
+    assert [cells[1, column].value for column in range(1, 7)] == [12, -3.5, 0.5, 1000.0, 7, 4]
+    assert [cells[2, column].value for column in range(1, 7)] == ["NaN", "inf", "-Infinity", "1_000", "1e400", "0x1F"]
+    assert {cells[2, column].data_type for column in range(1, 7)} == {"string"}
+    assert cells[3, 1].value == datetime.datetime(2024, 1, 31)
+    assert cells[3, 3].value == "12%"
+    # Everything read can be sent in a request body as strict JSON
+    json.dumps([cell.value for cell in cells.values()], default=str, allow_nan=False)
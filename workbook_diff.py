@@ -0,0 +1,1321 @@
+import os
+import re
+import html
+import time
+import random
+import zipfile
+import datetime
+import posixpath
+import logging
+import xml.etree.ElementTree as ET
+from openpyxl.formula.translate import Translator
+from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format
+from openpyxl.utils import get_column_letter, column_index_from_string
+from openpyxl.utils.datetime import from_excel, CALENDAR_WINDOWS_1900, CALENDAR_MAC_1904
+from workbook_readers import open_workbook, iter_rows
+
+logger = logging.getLogger(__name__)
+
+# Labels that identify the return metrics the Gemini prompt asks for
+RETURN_METRIC_PATTERNS = {
+    "npv": re.compile(r"\bnpv\b|net present value", re.IGNORECASE),
+    "irr": re.compile(r"\birr\b|internal rate of return", re.IGNORECASE),
+    "payback_period": re.compile(r"payback", re.IGNORECASE),
+    "roi": re.compile(r"\broi\b|return on investment", re.IGNORECASE),
+    "profit_margin": re.compile(r"profit margin", re.IGNORECASE),
+    "moic": re.compile(r"\bmoic\b|multiple on invested capital|equity multiple", re.IGNORECASE),
+}
+_ANY_METRIC_RE = re.compile("|".join(pattern.pattern for pattern in RETURN_METRIC_PATTERNS.values()), re.IGNORECASE)
+_ANY_METRIC_BYTES_RE = re.compile(_ANY_METRIC_RE.pattern.encode("ascii"), re.IGNORECASE)
+# Lower-case words every pattern above requires, to find candidate labels with bytes.find
+_METRIC_KEYWORDS = (b"npv", b"net present value", b"irr", b"internal rate of return", b"payback", b"roi",
+                    b"return on investment", b"profit margin", b"moic", b"multiple on invested capital",
+                    b"equity multiple")
+
+_MAIN_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_PKG_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+# Worksheet XML is scanned as bytes; elements may carry a namespace prefix such as <x:row>
+_SHEET_DATA_RE = re.compile(rb'<(\w+:)?sheetData\b')
+_SHARED_STRINGS_RE = re.compile(rb'<(\w+:)?sst\b')
+_ROW_NUMBER_RE = re.compile(rb'\br="(\d+)"')
+_CELL_RE = re.compile(rb'<(?:\w+:)?c\b([^>]*?)(?:/>|>(.*?)</(?:\w+:)?c>)', re.DOTALL)
+_FORMULA_RE = re.compile(rb'<(?:\w+:)?f\b([^>]*?)(?:/>|>(.*?)</(?:\w+:)?f>)', re.DOTALL)
+_VALUE_RE = re.compile(rb'<(?:\w+:)?v>(.*?)</(?:\w+:)?v>', re.DOTALL)
+_INLINE_TEXT_RE = re.compile(rb'<(?:\w+:)?t\b[^>]*>(.*?)</(?:\w+:)?t>', re.DOTALL)
+_SHARED_STRING_CELL_RE = re.compile(rb'(t="s"[^>]*><(?:\w+:)?v>)(\d+)(?=</)')
+_INLINE_STRING_CELL_RE = re.compile(rb't="inlineStr"[^>]*>(.*?)</(?:\w+:)?is>', re.DOTALL)
+_PHONETIC_RE = re.compile(rb'<(?:\w+:)?rPh\b.*?</(?:\w+:)?rPh>', re.DOTALL)
+_ATTRIBUTE_RE = re.compile(rb'([\w:]+)="([^"]*)"')
+_FORMULA_REFERENCE_RE = re.compile(r'\b(\$?[A-Za-z]{1,3}\$?)(\d+)\b(?!\()')
+
+
+def is_potential_keyword(text):
+    """Check if a cell value could be a label rather than data"""
+    if not isinstance(text, str):
+        return False
+    # Not a formula, not just numeric
+    return not text.startswith('=') and not re.match(r'^-?\d+(\.\d+)?$', text.strip())
+
+
+def _to_number(value):
+    """Best-effort conversion of a displayed value such as '$-1,000' or '12.5%' to a float"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str):
+        return None
+    text = value.strip().replace(",", "").replace("$", "")
+    percent = text.endswith("%")
+    if percent:
+        text = text[:-1]
+    if text.startswith("(") and text.endswith(")"):
+        text = "-" + text[1:-1]
+    try:
+        number = float(text)
+    except ValueError:
+        return None
+    return number / 100 if percent else number
+
+
+def _attributes(text):
+    """Parse the attributes of an XML start tag into a dictionary of bytes"""
+    return dict(_ATTRIBUTE_RE.findall(text))
+
+
+class _Worksheet:
+    """
+    The raw XML of one worksheet, split into rows without parsing any cells
+
+    Splitting on the row end tag gives one chunk per row. A chunk carries its row number, so
+    identical rows at the same position are found with set operations; row_key() drops the
+    number so a row still matches itself after rows were inserted or deleted above it. Element
+    names may carry a namespace prefix (e.g. <x:row>); it is read from the sheetData element.
+    """
+
+    def __init__(self, xml):
+        self.xml = xml
+        match = _SHEET_DATA_RE.search(xml)
+        self.prefix = match.group(1) or b"" if match else b""
+        self.row_tag = b"<" + self.prefix + b"row"
+        self.row_end = b"</" + self.prefix + b"row>"
+        # Where the rows start; the sheet properties before them change with any edit to the sheet
+        self.data_start = xml.find(b">", match.end()) + 1 if match else 0
+        self.numbered_tag = self.row_tag + b' r="'
+        first_row = xml.find(self.row_tag)
+        self.numbered = first_row == -1 or bool(_ROW_NUMBER_RE.search(xml, first_row, xml.find(b">", first_row)))
+        self._masters = None
+
+    def chunks(self, string_map=None):
+        """
+        The text up to each row end tag, from the start of the sheet data; the text after the last row is left out
+
+        Args:
+            string_map: Shared string indices to rewrite in string cells, as {b"index": b"replacement"}
+        """
+        xml = self.xml
+        if string_map:
+            xml = _SHARED_STRING_CELL_RE.sub(lambda m: m.group(1) + string_map.get(m.group(2), m.group(2)), xml)
+        chunks = xml.split(self.row_end)[:-1]
+        if chunks:
+            chunks[0] = chunks[0][self.data_start:]
+        return chunks
+
+    def _row_tag(self, chunk):
+        """(start, end) of the start tag of the row a chunk ends with, or None"""
+        tag_length = len(self.row_tag)
+        start = chunk.find(self.row_tag)
+        while start != -1:
+            tag_end = chunk.find(b">", start)
+            # Skip elements that only share the prefix, such as <rowBreaks>, and empty rows
+            if chunk[start + tag_length:start + tag_length + 1] in (b" ", b">") and chunk[tag_end - 1] != 47:
+                return start, tag_end
+            start = chunk.find(self.row_tag, tag_end)
+        return None
+
+    def parse_chunk(self, chunk, number=None):
+        """(row number, cell XML) of a chunk, or None if it does not hold a row with cells"""
+        tag = self._row_tag(chunk)
+        if tag is None:
+            return None
+        if number is None:
+            number = int(_ROW_NUMBER_RE.search(chunk, *tag).group(1))
+        return number, chunk[tag[1] + 1:]
+
+    def row_key(self, chunk):
+        """
+        (row number, chunk without its row number) on a sheet with numbered rows, or None if it does not hold a row
+
+        The key is equal for identical rows wherever they are. A row with another cell attribute
+        ending in the row number, such as s="12" on row 12, keeps its number.
+        """
+        tag = None
+        if chunk.startswith(self.numbered_tag):
+            tag_end = chunk.find(b">")
+            if tag_end > 0 and chunk[tag_end - 1] != 47:
+                tag = 0, tag_end
+        if tag is None:
+            tag = self._row_tag(chunk)
+            if tag is None:
+                return None
+        tag_start, tag_end = tag
+        position = chunk.find(b' r="', tag_start, tag_end)
+        if position == -1:
+            return int(_ROW_NUMBER_RE.search(chunk, tag_start, tag_end).group(1)), chunk
+        number_end = chunk.find(b'"', position + 4)
+        number = int(chunk[position + 4:number_end])
+        cells = chunk[tag_end + 1:]
+        token = b'%d"' % number
+        key = cells.replace(token, b'"')
+        if len(cells) - len(key) != (len(token) - 1) * cells.count(b' r="'):
+            return number, chunk
+        # Only r is dropped from the row tag, whose other attributes such as spans="1:5" may end in the number
+        return number, chunk[:position + 4] + chunk[number_end:tag_end + 1] + key
+
+    def row_at(self, position):
+        """(row number, cell XML) of the row containing a byte offset, or None if it is not inside a row"""
+        xml = self.xml
+        start = xml.rfind(self.row_tag, 0, position)
+        end = xml.find(self.row_end, position)
+        if start == -1 or end == -1 or xml.rfind(self.row_end, start, position) != -1:
+            return None
+        chunk_start = xml.rfind(self.row_end, 0, start)
+        chunk = xml[self.data_start if chunk_start == -1 else chunk_start + len(self.row_end):end]
+        return self.parse_chunk(chunk, None if self.numbered else xml.count(self.row_tag, 0, end))
+
+    def rows_matching(self, pattern):
+        """{row number: chunk} of the rows holding a match of a compiled pattern"""
+        xml = self.xml
+        rows = {}
+        counted = count = 0
+        for match in pattern.finditer(xml):
+            position = match.start()
+            start = xml.rfind(self.row_tag, 0, position)
+            end = xml.find(self.row_end, position)
+            if start == -1 or end == -1 or xml.rfind(self.row_end, start, position) != -1:
+                continue
+            if not self.numbered:
+                count += xml.count(self.row_tag, counted, end)
+                counted = end
+            chunk_start = xml.rfind(self.row_end, 0, start)
+            chunk = xml[self.data_start if chunk_start == -1 else chunk_start + len(self.row_end):end]
+            parsed = self.parse_chunk(chunk, None if self.numbered else count)
+            if parsed:
+                rows[parsed[0]] = chunk
+        return rows
+
+    def rows_at(self, positions):
+        """{row number: cell XML} of the rows containing any of the byte offsets"""
+        rows = {}
+        for position in positions:
+            parsed = self.row_at(position)
+            if parsed:
+                rows[parsed[0]] = parsed[1]
+        return rows
+
+    def string_positions(self, string_indices):
+        """Byte offsets of cells using one of these shared strings"""
+        if len(string_indices) <= 20:
+            # A few strings are quicker to find directly; a numeric cell of the same value only
+            # costs decoding one extra row
+            for index in string_indices:
+                token = self.value_token(index)
+                position = self.xml.find(token)
+                while position != -1:
+                    yield position
+                    position = self.xml.find(token, position + 1)
+            return
+        for match in _SHARED_STRING_CELL_RE.finditer(self.xml):
+            if int(match.group(2)) in string_indices:
+                yield match.start()
+
+    def value_token(self, index):
+        return b"<%sv>%d</%sv>" % (self.prefix, index, self.prefix)
+
+    def metric_positions(self, metric_strings):
+        """Byte offsets of cells whose text may be a return metric label"""
+        yield from self.string_positions(metric_strings)
+        for match in _INLINE_STRING_CELL_RE.finditer(self.xml):
+            if _ANY_METRIC_BYTES_RE.search(match.group(1)):
+                yield match.start()
+
+    @property
+    def shared_formulas(self):
+        """Master formula and origin cell of each shared formula group, collected on first use"""
+        if self._masters is None:
+            self._masters = {}
+            xml = self.xml
+            if b' si="' in xml:
+                formula_tag = b"<" + self.prefix + b"f "
+                position = xml.find(b' ref="')
+                while position != -1:
+                    tag_start = xml.rfind(b"<", 0, position)
+                    tag_end = xml.find(b">", position)
+                    if xml.startswith(formula_tag, tag_start) and xml[tag_end - 1] != 47:
+                        attributes = _attributes(xml[tag_start:tag_end])
+                        if attributes.get(b"t") == b"shared" and b"si" in attributes:
+                            text = xml[tag_end + 1:xml.find(b"<", tag_end)]
+                            origin = attributes[b"ref"].split(b":")[0].decode("ascii")
+                            self._masters[attributes[b"si"]] = ("=" + html.unescape(text.decode("utf-8")), origin)
+                    position = xml.find(b' ref="', tag_end)
+        return self._masters
+
+    def formula(self, group, coordinate):
+        """The formula a child of a shared formula group holds at `coordinate`"""
+        master = self.shared_formulas.get(group)
+        if master is None:
+            return None
+        text, origin = master
+        if origin == coordinate:
+            return text
+        return Translator(text, origin=origin).translate_formula(coordinate)
+
+
+class _XlsxPackage:
+    """
+    Direct access to the worksheet XML inside an .xlsx or .xlsm package.
+
+    The diff compares raw row XML first and only decodes rows whose bytes differ, which
+    avoids building a cell object for every cell of a large model.
+    """
+
+    def __init__(self, file_path):
+        self.zf = zipfile.ZipFile(file_path)
+        try:
+            self.infos = {info.filename: info for info in self.zf.infolist()}
+            workbook_xml = ET.fromstring(self.zf.read("xl/workbook.xml"))
+            rels_xml = ET.fromstring(self.zf.read("xl/_rels/workbook.xml.rels"))
+        except Exception:
+            self.zf.close()
+            raise
+
+        targets = {}
+        for rel in rels_xml.iter(f"{_PKG_REL_NS}Relationship"):
+            target = rel.get("Target", "")
+            if target.startswith("/"):
+                target = target.lstrip("/")
+            else:
+                target = posixpath.normpath(posixpath.join("xl", target))
+            targets[rel.get("Id")] = target
+
+        self.sheets = {}
+        for sheet in workbook_xml.iter(f"{_MAIN_NS}sheet"):
+            member = targets.get(sheet.get(f"{_REL_NS}id"))
+            if member in self.infos:
+                self.sheets[sheet.get("name")] = member
+        if not self.sheets:
+            self.zf.close()
+            raise ValueError("no worksheets found in package")
+
+        properties = workbook_xml.find(f"{_MAIN_NS}workbookPr")
+        date1904 = properties is not None and properties.get("date1904") in ("1", "true")
+        self.epoch = CALENDAR_MAC_1904 if date1904 else CALENDAR_WINDOWS_1900
+        self._string_items = None
+        self._strings_xml = b""
+        self._string_item_end = b"</si>"
+        self._strings = {}
+        self._date_styles = None
+
+    @property
+    def sheet_names(self):
+        return list(self.sheets)
+
+    def fingerprint(self, member):
+        """CRC32 and size of a worksheet or other package member, or None if it does not exist"""
+        info = self.infos.get(self.sheets.get(member, member))
+        return (info.CRC, info.file_size) if info else None
+
+    def worksheet(self, sheet_name):
+        return _Worksheet(self.zf.read(self.sheets[sheet_name]))
+
+    @property
+    def string_items(self):
+        """Raw XML of each shared string item; text is only decoded for cells that are compared"""
+        if self._string_items is None:
+            self._string_items = []
+            self._strings_xml = b""
+            if "xl/sharedStrings.xml" in self.infos:
+                data = self._strings_xml = self.zf.read("xl/sharedStrings.xml")
+                match = _SHARED_STRINGS_RE.search(data)
+                prefix = match.group(1) or b"" if match else b""
+                item_tag = b"<" + prefix + b"si"
+                self._string_item_end = b"</" + prefix + b"si>"
+                # Each piece is one "<si>...</si>" item without its end tag; the text after the
+                # last one is not an item and the table's start tag is cut off the first
+                items = data.split(self._string_item_end)[:-1]
+                if items:
+                    items[0] = items[0][items[0].rfind(item_tag):]
+                self._string_items = items
+        return self._string_items
+
+    def shared_string(self, index):
+        text = self._strings.get(index)
+        if text is None:
+            items = self.string_items
+            if index >= len(items):
+                return None
+            # Rich text runs are joined; phonetic hints are not part of the value
+            item = _PHONETIC_RE.sub(b"", items[index])
+            text = self._strings[index] = html.unescape(b"".join(_INLINE_TEXT_RE.findall(item)).decode("utf-8"))
+        return text
+
+    def metric_string_indices(self):
+        """Shared string indices whose text looks like a return metric label"""
+        if not self.string_items:
+            return set()
+        data = self._strings_xml.lower()
+        indices = set()
+        for keyword in _METRIC_KEYWORDS:
+            position = data.find(keyword)
+            while position != -1:
+                index = data.count(self._string_item_end, 0, position)
+                if index not in indices and _ANY_METRIC_RE.search(self.shared_string(index) or ""):
+                    indices.add(index)
+                position = data.find(keyword, position + len(keyword))
+        return indices
+
+    @property
+    def date_styles(self):
+        """Indices of the cell styles that display numbers as dates"""
+        if self._date_styles is None:
+            styles = set()
+            if "xl/styles.xml" in self.infos:
+                root = ET.fromstring(self.zf.read("xl/styles.xml"))
+                formats = dict(BUILTIN_FORMATS)
+                for number_format in root.iter(f"{_MAIN_NS}numFmt"):
+                    formats[int(number_format.get("numFmtId", 0))] = number_format.get("formatCode", "")
+                cell_formats = root.find(f"{_MAIN_NS}cellXfs")
+                if cell_formats is not None:
+                    for index, cell_format in enumerate(cell_formats.findall(f"{_MAIN_NS}xf")):
+                        code = formats.get(int(cell_format.get("numFmtId", 0)))
+                        if code and is_date_format(code):
+                            styles.add(index)
+            self._date_styles = styles
+        return self._date_styles
+
+    def close(self):
+        self.zf.close()
+
+
+def _open_package(file_path):
+    """Open an .xlsx/.xlsm package for direct XML access, or None to fall back to the reader registry"""
+    if os.path.splitext(file_path)[1].lower() not in (".xlsx", ".xlsm"):
+        return None
+    try:
+        return _XlsxPackage(file_path)
+    except (zipfile.BadZipFile, KeyError, ET.ParseError, ValueError, OSError) as e:
+        logger.info(f"Reading {file_path} through the reader registry: {e}")
+        return None
+
+
+def _cell_value(cell_type, style, body, package):
+    """Decode a cell value the way openpyxl does, including shared strings and date styles"""
+    if cell_type == b"inlineStr":
+        return html.unescape(b"".join(_INLINE_TEXT_RE.findall(body)).decode("utf-8"))
+    match = _VALUE_RE.search(body)
+    if match is None:
+        return None
+    raw = match.group(1)
+    if cell_type == b"s":
+        return package.shared_string(int(raw))
+    if cell_type == b"b":
+        return raw.strip() in (b"1", b"true")
+    if cell_type in (b"str", b"e"):
+        return html.unescape(raw.decode("utf-8"))
+    if cell_type == b"d":
+        text = raw.decode("ascii")
+        try:
+            return datetime.datetime.fromisoformat(text)
+        except ValueError:
+            return text
+    number = float(raw) if b"." in raw or b"e" in raw or b"E" in raw else int(raw)
+    if style is not None and int(style) in package.date_styles:
+        try:
+            return from_excel(number, package.epoch)
+        except (ValueError, OverflowError):
+            pass
+    return number
+
+
+def _cell_formula(body, coordinate, sheet):
+    match = _FORMULA_RE.search(body)
+    if match is None:
+        return None
+    if match.group(2):
+        return "=" + html.unescape(match.group(2).decode("utf-8"))
+    attributes = _attributes(match.group(1))
+    if attributes.get(b"t") == b"shared" and b"si" in attributes:
+        return sheet.formula(attributes[b"si"], coordinate)
+    return None
+
+
+def _decode_row(xml, row_number, package, sheet):
+    """Decode the cell XML of one row into a (values, formulas) tuple like _read_sheet_rows produces"""
+    if xml is None:
+        return (), ()
+    values = []
+    formulas = []
+    column = 0
+    for match in _CELL_RE.finditer(xml):
+        attributes = _attributes(match.group(1))
+        reference = attributes.get(b"r")
+        if reference:
+            column = column_index_from_string(reference.rstrip(b"0123456789").decode("ascii"))
+        else:
+            column += 1
+        body = match.group(2) or b""
+        value = _cell_value(attributes.get(b"t"), attributes.get(b"s"), body, package)
+        formula = _cell_formula(body, f"{get_column_letter(column)}{row_number}", sheet)
+        if value is None and formula is None:
+            continue
+        while len(values) < column:
+            values.append(None)
+            formulas.append(None)
+        values[column - 1] = value
+        formulas[column - 1] = formula
+    return _trim_row(values, formulas)
+
+
+def _shared_string_map(old_package, new_package):
+    """
+    Translation of the new package's shared string indices into the old package's, or None if they agree
+
+    Excel rewrites the table in order of first use when it saves, so one new label shifts the
+    index of every string after it. Strings that are not in the old table get a value no old
+    string cell can hold.
+    """
+    if old_package.fingerprint("xl/sharedStrings.xml") == new_package.fingerprint("xl/sharedStrings.xml"):
+        return None
+    old_items = old_package.string_items
+    old_indices = {}
+    for index, item in enumerate(old_items):
+        old_indices.setdefault(item, index)
+    string_map = {}
+    for index, item in enumerate(new_package.string_items):
+        old_index = old_indices.get(item)
+        if old_index == index or (old_index is None and index >= len(old_items)):
+            continue
+        string_map[b"%d" % index] = b"%d" % old_index if old_index is not None else b"new%d" % index
+    return string_map or None
+
+
+def _changed_date_styles(old_package, new_package):
+    """Style indices whose numbers decode to different dates or to a date in only one package"""
+    if old_package.epoch != new_package.epoch:
+        # Switching between the 1900 and 1904 date systems moves every date by four years
+        return old_package.date_styles | new_package.date_styles
+    if old_package.fingerprint("xl/styles.xml") == new_package.fingerprint("xl/styles.xml"):
+        return set()
+    return old_package.date_styles ^ new_package.date_styles
+
+
+def _scan_metrics(sheet_name, sheet, package, metric_strings):
+    """Find return metrics in a worksheet, decoding only the rows that can hold a metric label"""
+    rows = sheet.rows_at(sheet.metric_positions(metric_strings))
+    return _find_return_metrics(sheet_name, ((number - 1, _decode_row(rows[number], number, package, sheet))
+                                             for number in sorted(rows)))
+
+
+def _trim_row(values, formulas):
+    """Drop trailing empty cells so padding differences do not count as changes"""
+    end = len(values)
+    while end and values[end - 1] is None and formulas[end - 1] is None:
+        end -= 1
+    return tuple(values[:end]), tuple(formulas[:end])
+
+
+def _read_sheet_rows(reader, sheet_name):
+    """Read a sheet as a list of (values, formulas) row tuples, one per row number"""
+    rows = []
+    for _, row_number, values, formulas in iter_rows(reader.iter_sheet(sheet_name)):
+        while len(rows) < row_number - 1:
+            rows.append(((), ()))
+        rows.append(_trim_row(values, formulas))
+    return rows
+
+
+def _reader_row_key(row, index):
+    """A row read from a reader with relative row references as offsets, equal for identical rows wherever they are"""
+    values, formulas = row
+    if not any(formulas):
+        return row
+    number = index + 1
+
+    def offset(match):
+        if match.group(1).endswith("$"):
+            return match.group(0)
+        return "%s~%d" % (match.group(1), int(match.group(2)) - number)
+
+    return values, tuple(_FORMULA_REFERENCE_RE.sub(offset, formula) if isinstance(formula, str) else formula
+                         for formula in formulas)
+
+
+def _is_label(value):
+    """A text cell that is not a displayed number such as '$1,000' or '12%'"""
+    return is_potential_keyword(value) and bool(value.strip()) and _to_number(value) is None
+
+
+def _is_input_value(value):
+    """Hardcoded data rather than a label: numbers, dates, booleans and numeric text"""
+    return value is not None and (not isinstance(value, str) or _to_number(value) is not None)
+
+
+def _row_label(values, column):
+    """Find the nearest label to the left of a cell, as Analyzer.py pairs keywords with numbers"""
+    for j in range(min(column, len(values)) - 1, -1, -1):
+        if _is_label(values[j]):
+            return values[j].strip()
+    return ""
+
+
+def _first_label(values):
+    for value in values:
+        if _is_label(value):
+            return value.strip()
+    return None
+
+
+def _find_return_metrics(sheet_name, rows):
+    """
+    Detect return metric labels and the first value to their right
+
+    Args:
+        sheet_name: Name of the sheet the rows belong to
+        rows: Iterable of (row index, (values, formulas)) in sheet order
+    """
+    metrics = {}
+    for i, (values, _) in rows:
+        for j, cell in enumerate(values):
+            if not is_potential_keyword(cell):
+                continue
+            for key, pattern in RETURN_METRIC_PATTERNS.items():
+                if key in metrics or not pattern.search(cell):
+                    continue
+                for k in range(j + 1, len(values)):
+                    if values[k] is not None and values[k] != "":
+                        metrics[key] = {
+                            "label": cell.strip(),
+                            "value": values[k],
+                            "location": f"{sheet_name}!{get_column_letter(k + 1)}{i + 1}",
+                        }
+                        break
+                break
+    return metrics
+
+
+def _collapse_row_moves(moves):
+    """Collapse consecutive row moves with the same offset into blocks"""
+    blocks = []
+    for old_index, new_index in sorted(moves, key=lambda m: m[1]):
+        if blocks:
+            block = blocks[-1]
+            if (new_index == block["to_end"] + 1 and
+                    old_index - new_index == block["from_start"] - block["to_start"]):
+                block["from_end"] = old_index
+                block["to_end"] = new_index
+                continue
+        blocks.append({"from_start": old_index, "from_end": old_index,
+                       "to_start": new_index, "to_end": new_index})
+    return blocks
+
+
+def _match_rows(old_rows, new_rows):
+    """
+    Pair identical rows of two versions of a sheet, wherever they moved to
+
+    Rows already known to be identical in place are passed as None; they only anchor the rows
+    around them. Rows with a key of None are never paired.
+
+    Args:
+        old_rows: (row index, key) or None for each row of the old sheet, in sheet order
+        new_rows: (row index, key) or None for each row of the new sheet, in sheet order
+
+    Returns:
+        (pairs of (old index, new index), {unmatched old index: index its neighbours moved it to},
+        unmatched new indices)
+    """
+    # Old index of each key, or {old index: None} in sheet order for keys on several rows
+    candidates = {}
+    for row in old_rows:
+        if row is None or row[1] is None:
+            continue
+        index, key = row
+        found = candidates.get(key)
+        if found is None:
+            candidates[key] = index
+        elif isinstance(found, dict):
+            found[index] = None
+        else:
+            candidates[key] = {found: None, index: None}
+
+    pairs = []
+    repeated = []
+    offset = 0
+    for row in new_rows:
+        if row is None:
+            offset = 0
+            continue
+        index, key = row
+        found = candidates.get(key)
+        if found is None:
+            continue
+        if not isinstance(found, dict):
+            old_index = found
+            del candidates[key]
+        elif index + offset in found:
+            old_index = index + offset
+            del found[old_index]
+        else:
+            # A row that occurs several times is placed once the rows around the others are known
+            repeated.append(row)
+            continue
+        pairs.append((old_index, index))
+        offset = old_index - index
+    for index, key in repeated:
+        found = candidates.get(key)
+        if found:
+            old_index = next(iter(found))
+            del found[old_index]
+            pairs.append((old_index, index))
+
+    new_by_old = dict(pairs)
+    matched_new = set(new_by_old.values())
+    aligned = {}
+    offset = 0
+    for row in old_rows:
+        if row is None:
+            offset = 0
+        elif row[0] in new_by_old:
+            offset = new_by_old[row[0]] - row[0]
+        else:
+            aligned[row[0]] = row[0] + offset
+    unmatched_new = [row[0] for row in new_rows if row is not None and row[0] not in matched_new]
+    return pairs, aligned, unmatched_new
+
+
+def _same_formula(old_formula, new_formula, old_coordinate, new_coordinate):
+    """Formulas are unchanged if the old one, moved with its row, reads the same as the new one"""
+    if old_formula == new_formula:
+        return True
+    if not old_formula or not new_formula or old_coordinate == new_coordinate:
+        return False
+    try:
+        return Translator(old_formula, origin=old_coordinate).translate_formula(new_coordinate) == new_formula
+    except Exception:
+        return False
+
+
+def _diff_sheet(sheet_name, old_rows, new_rows, report, row_moves=(), aligned=None):
+    """
+    Describe the changes between two versions of a sheet
+
+    Args:
+        sheet_name: Name of the sheet
+        old_rows: {row index: (values, formulas)} of the old rows without an identical new row
+        new_rows: {row index: (values, formulas)} of the new rows without an identical old row
+        report: Report dictionary to add the changes to
+        row_moves: (old index, new index) of identical rows that moved
+        aligned: {old row index: new row index} where the rows around an unmatched old row moved it
+    """
+    changed = sorted(set(old_rows) | set(new_rows))
+    report["stats"]["rows_compared"] += len(changed)
+    row_moves = list(row_moves)
+    if not changed and not row_moves:
+        return
+
+    # Rows whose XML differs may still hold the same values, e.g. after a style change
+    old_by_hash = {}
+    for i in changed:
+        if i in old_rows and old_rows[i][0]:
+            old_by_hash.setdefault(old_rows[i], []).append(i)
+    paired_old = set()
+    paired_new = set()
+    for i in changed:
+        if i in new_rows and new_rows[i][0]:
+            candidates = old_by_hash.get(new_rows[i])
+            if candidates:
+                old_index = candidates.pop(0)
+                paired_old.add(old_index)
+                paired_new.add(i)
+                if old_index != i:
+                    row_moves.append((old_index, i))
+
+    # Rows that moved and were also edited are matched by their label before comparing cells
+    old_labels = {}
+    new_labels = {}
+    for i in changed:
+        if i in old_rows and i not in paired_old:
+            old_labels.setdefault(_first_label(old_rows[i][0]), []).append(i)
+        if i in new_rows and i not in paired_new:
+            new_labels.setdefault(_first_label(new_rows[i][0]), []).append(i)
+    comparisons = []
+    for label, new_indices in new_labels.items():
+        old_indices = old_labels.get(label)
+        if label is None or not old_indices or len(old_indices) != 1 or len(new_indices) != 1:
+            continue
+        old_index, new_index = old_indices[0], new_indices[0]
+        comparisons.append((old_index, new_index))
+        paired_old.add(old_index)
+        paired_new.add(new_index)
+        if old_index != new_index:
+            row_moves.append((old_index, new_index))
+
+    # Everything else is compared with the row its neighbours moved it to, or else in place
+    aligned = aligned or {}
+    unpaired_new = {i for i in new_rows if i not in paired_new}
+    for i in changed:
+        if i not in old_rows or i in paired_old:
+            continue
+        new_index = aligned.get(i, i)
+        if new_index not in unpaired_new:
+            new_index = i if i in unpaired_new else None
+        if new_index is not None:
+            unpaired_new.discard(new_index)
+            if new_index != i:
+                row_moves.append((i, new_index))
+        comparisons.append((i, new_index))
+    comparisons.extend((None, i) for i in sorted(unpaired_new))
+
+    for block in _collapse_row_moves(row_moves):
+        report["moved_rows"].append({
+            "sheet": sheet_name,
+            "from_rows": f"{block['from_start'] + 1}-{block['from_end'] + 1}",
+            "to_rows": f"{block['to_start'] + 1}-{block['to_end'] + 1}",
+        })
+
+    removed_inputs = {}
+    added_inputs = {}
+    input_changes = []
+    for old_index, new_index in sorted(comparisons, key=lambda c: c[1] if c[1] is not None else c[0]):
+        old_values, old_formulas = old_rows[old_index] if old_index is not None else ((), ())
+        new_values, new_formulas = new_rows[new_index] if new_index is not None else ((), ())
+        old_row = (old_index if old_index is not None else new_index) + 1
+        new_row = (new_index if new_index is not None else old_index) + 1
+        for j in range(max(len(old_values), len(new_values))):
+            old_value = old_values[j] if j < len(old_values) else None
+            new_value = new_values[j] if j < len(new_values) else None
+            old_formula = old_formulas[j] if j < len(old_formulas) else None
+            new_formula = new_formulas[j] if j < len(new_formulas) else None
+            column = get_column_letter(j + 1)
+            same_formula = _same_formula(old_formula, new_formula, f"{column}{old_row}", f"{column}{new_row}")
+            if old_value == new_value and same_formula:
+                continue
+
+            old_location = f"{sheet_name}!{column}{old_row}"
+            location = f"{sheet_name}!{column}{new_row}"
+            label = _row_label(new_values, j) or _row_label(old_values, j)
+            if old_formula or new_formula:
+                if not same_formula:
+                    report["changed_formulas"].append({
+                        "location": location,
+                        "label": label,
+                        "old_formula": old_formula,
+                        "new_formula": new_formula,
+                        "old_value": old_value,
+                        "new_value": new_value,
+                    })
+                continue
+
+            # Edited row labels and headings are not model inputs
+            if not _is_input_value(old_value) and not _is_input_value(new_value):
+                continue
+            if _to_number(old_value) is not None and not isinstance(old_value, str):
+                removed_inputs.setdefault(old_value, []).append(old_location)
+            if _to_number(new_value) is not None and not isinstance(new_value, str):
+                added_inputs.setdefault(new_value, []).append(location)
+            input_changes.append((old_location, {
+                "location": location,
+                "label": label,
+                "old": old_value,
+                "new": new_value,
+            }))
+
+    # A hardcoded number that vanished from one cell and appeared in another has moved
+    moved_from = set()
+    moved_to = set()
+    for value, sources in removed_inputs.items():
+        destinations = added_inputs.get(value, [])
+        for source, destination in zip(sources, destinations):
+            if source == destination:
+                continue
+            report["moved_values"].append({"value": value, "from": source, "to": destination})
+            moved_from.add(source)
+            moved_to.add(destination)
+
+    for old_location, change in input_changes:
+        location = change["location"]
+        if old_location in moved_from and location in moved_to:
+            continue
+        if old_location in moved_from and change["new"] is None:
+            continue
+        if location in moved_to and change["old"] is None:
+            continue
+        report["changed_inputs"].append(change)
+
+
+def _same_master(old_master, new_master):
+    """Shared formula masters are unchanged if the old one, moved to the new origin, reads the same"""
+    if old_master is None or new_master is None:
+        return old_master == new_master
+    return _same_formula(old_master[0], new_master[0], old_master[1], new_master[1])
+
+
+def _changed_package_rows(old_sheet, new_sheet, old_package, new_package, string_map, date_styles, stats):
+    """
+    Match the rows of two versions of a sheet by their raw XML and decode only the rest
+
+    Rows identical in place are found with set operations on the chunks. The remaining rows are
+    matched by their XML without the row number, so inserting or deleting a row only costs
+    decoding the rows that really changed.
+
+    Args:
+        string_map: Translation of the new package's shared string indices into the old one's, or None
+        date_styles: Style indices that display dates in one package but not the other
+
+    Returns:
+        (old rows, new rows, row moves, aligned) as _diff_sheet() takes them
+    """
+    old_chunks = old_sheet.chunks()
+    new_chunks = new_sheet.chunks()
+    new_key_chunks = new_sheet.chunks(string_map) if string_map else new_chunks
+
+    # Byte-identical rows still change meaning when a date style or shared formula they use changed
+    tokens = [b' s="%d"' % style for style in date_styles]
+    if b' si="' in old_sheet.xml or b' si="' in new_sheet.xml:
+        old_masters = old_sheet.shared_formulas
+        new_masters = new_sheet.shared_formulas
+        tokens += [b' si="' + group + b'"' for group in set(old_masters) | set(new_masters)
+                   if not _same_master(old_masters.get(group), new_masters.get(group))]
+    old_suspects = {}
+    new_suspects = {}
+    if tokens:
+        pattern = re.compile(b"|".join(map(re.escape, tokens)))
+        old_suspects = old_sheet.rows_matching(pattern)
+        new_suspects = new_sheet.rows_matching(pattern)
+
+    identical = set()
+    if old_sheet.numbered and new_sheet.numbered:
+        # A chunk holds its row number, so equal chunks are the same row in the same place
+        identical = set(old_chunks).intersection(new_key_chunks).difference(old_suspects.values())
+        stats["rows_skipped"] += len(identical)
+
+    def rows(sheet, chunks, key_chunks, suspects):
+        entries = []
+        row_chunks = {}
+        number = 0
+        for chunk, key_chunk in zip(chunks, key_chunks):
+            if not sheet.numbered:
+                number += chunk.count(sheet.row_tag)
+                if sheet.parse_chunk(chunk, number) is None:
+                    continue
+                key = key_chunk
+            elif key_chunk in identical:
+                entries.append(None)
+                continue
+            else:
+                keyed = sheet.row_key(key_chunk)
+                if keyed is None:
+                    continue
+                number, key = keyed
+            row_chunks[number] = chunk
+            entries.append((number, None if number in suspects else key))
+        return entries, row_chunks
+
+    def decode(sheet, package, chunk, number):
+        return _decode_row(sheet.parse_chunk(chunk, number)[1], number, package, sheet)
+
+    old_entries, old_row_chunks = rows(old_sheet, old_chunks, old_chunks, old_suspects)
+    new_entries, new_row_chunks = rows(new_sheet, new_chunks, new_key_chunks, new_suspects)
+    pairs, aligned, unmatched_new = _match_rows(old_entries, new_entries)
+    stats["rows_skipped"] += len(pairs)
+
+    old_rows = {number - 1: decode(old_sheet, old_package, old_row_chunks[number], number) for number in aligned}
+    new_rows = {number - 1: decode(new_sheet, new_package, new_row_chunks[number], number)
+                for number in unmatched_new}
+    row_moves = [(old - 1, new - 1) for old, new in pairs if old != new]
+    return old_rows, new_rows, row_moves, {old - 1: new - 1 for old, new in aligned.items()}
+
+
+def _compare_packages(old_package, new_package, report, progress_callback=None):
+    """
+    Diff two .xlsx packages through their worksheet XML
+
+    Returns:
+        (old metrics, new metrics) found in the two files
+    """
+    stats = report["stats"]
+    old_sheets = old_package.sheet_names
+    new_sheets = new_package.sheet_names
+    report["sheets_added"] = [name for name in new_sheets if name not in old_sheets]
+    report["sheets_removed"] = [name for name in old_sheets if name not in new_sheets]
+
+    # Rows store indices into these tables, so their keys must be read in the same numbering
+    string_map = _shared_string_map(old_package, new_package)
+    date_styles = _changed_date_styles(old_package, new_package)
+    tables_changed = bool(string_map or date_styles)
+    old_metric_strings = old_package.metric_string_indices()
+    new_metric_strings = new_package.metric_string_indices()
+
+    old_metrics = {}
+    new_metrics = {}
+    for sheet_name in new_sheets:
+        new_sheet = new_package.worksheet(sheet_name)
+        if sheet_name not in old_sheets:
+            for key, metric in _scan_metrics(sheet_name, new_sheet, new_package, new_metric_strings).items():
+                new_metrics.setdefault(key, metric)
+            continue
+
+        # Identical worksheet XML whose strings and date styles mean the same cannot have changed
+        if not tables_changed and old_package.fingerprint(sheet_name) == new_package.fingerprint(sheet_name):
+            report["sheets_unchanged"].append(sheet_name)
+            stats["sheets_skipped"] += 1
+            for key, metric in _scan_metrics(sheet_name, new_sheet, new_package, new_metric_strings).items():
+                old_metrics.setdefault(key, metric)
+                new_metrics.setdefault(key, metric)
+            continue
+
+        if progress_callback:
+            progress_callback(f"Comparing sheet '{sheet_name}'...")
+
+        old_sheet = old_package.worksheet(sheet_name)
+        for key, metric in _scan_metrics(sheet_name, old_sheet, old_package, old_metric_strings).items():
+            old_metrics.setdefault(key, metric)
+        for key, metric in _scan_metrics(sheet_name, new_sheet, new_package, new_metric_strings).items():
+            new_metrics.setdefault(key, metric)
+
+        old_rows, new_rows, row_moves, aligned = _changed_package_rows(
+            old_sheet, new_sheet, old_package, new_package, string_map, date_styles, stats)
+        if not old_rows and not new_rows and not row_moves:
+            report["sheets_unchanged"].append(sheet_name)
+            continue
+        _diff_sheet(sheet_name, old_rows, new_rows, report, row_moves, aligned)
+
+    for sheet_name in report["sheets_removed"]:
+        old_sheet = old_package.worksheet(sheet_name)
+        for key, metric in _scan_metrics(sheet_name, old_sheet, old_package, old_metric_strings).items():
+            old_metrics.setdefault(key, metric)
+    return old_metrics, new_metrics
+
+
+def _compare_readers(old_reader, new_reader, report, progress_callback=None):
+    """
+    Diff two workbooks read through the reader registry (.xls, .xlsb, .csv)
+
+    Returns:
+        (old metrics, new metrics) found in the two files
+    """
+    stats = report["stats"]
+    old_sheets = old_reader.sheet_names
+    new_sheets = new_reader.sheet_names
+    report["sheets_added"] = [name for name in new_sheets if name not in old_sheets]
+    report["sheets_removed"] = [name for name in old_sheets if name not in new_sheets]
+
+    old_metrics = {}
+    new_metrics = {}
+    for sheet_name in new_sheets:
+        new_rows = _read_sheet_rows(new_reader, sheet_name)
+        for key, metric in _find_return_metrics(sheet_name, enumerate(new_rows)).items():
+            new_metrics.setdefault(key, metric)
+        if sheet_name not in old_sheets:
+            continue
+
+        if progress_callback:
+            progress_callback(f"Comparing sheet '{sheet_name}'...")
+
+        old_rows = _read_sheet_rows(old_reader, sheet_name)
+        for key, metric in _find_return_metrics(sheet_name, enumerate(old_rows)).items():
+            old_metrics.setdefault(key, metric)
+
+        # Rows equal in place anchor the others, which are matched wherever they moved to
+        old_entries = []
+        new_entries = []
+        for i in range(max(len(old_rows), len(new_rows))):
+            old_row = old_rows[i] if i < len(old_rows) else None
+            new_row = new_rows[i] if i < len(new_rows) else None
+            if old_row == new_row:
+                stats["rows_skipped"] += 1
+                old_entries.append(None)
+                new_entries.append(None)
+                continue
+            if old_row is not None:
+                old_entries.append((i, _reader_row_key(old_row, i)))
+            if new_row is not None:
+                new_entries.append((i, _reader_row_key(new_row, i)))
+        pairs, aligned, unmatched_new = _match_rows(old_entries, new_entries)
+        stats["rows_skipped"] += len(pairs)
+        row_moves = [(old, new) for old, new in pairs if old != new]
+        if not aligned and not unmatched_new and not row_moves:
+            report["sheets_unchanged"].append(sheet_name)
+            continue
+        _diff_sheet(sheet_name, {i: old_rows[i] for i in aligned}, {i: new_rows[i] for i in unmatched_new},
+                    report, row_moves, aligned)
+
+    for sheet_name in report["sheets_removed"]:
+        old_rows = _read_sheet_rows(old_reader, sheet_name)
+        for key, metric in _find_return_metrics(sheet_name, enumerate(old_rows)).items():
+            old_metrics.setdefault(key, metric)
+    return old_metrics, new_metrics
+
+
+def diff_workbooks(old_path, new_path, progress_callback=None):
+    """
+    Compare two versions of an Excel financial model
+
+    Args:
+        old_path: Path to the earlier version of the workbook
+        new_path: Path to the later version of the workbook
+        progress_callback: Callback function to update progress
+
+    Returns:
+        Dictionary describing changed inputs, formulas, moved values and return metrics
+    """
+    start = time.perf_counter()
+    report = {
+        "old_file": os.path.basename(old_path),
+        "new_file": os.path.basename(new_path),
+        "sheets_added": [],
+        "sheets_removed": [],
+        "sheets_unchanged": [],
+        "changed_inputs": [],
+        "changed_formulas": [],
+        "moved_values": [],
+        "moved_rows": [],
+        "return_metrics": [],
+        "stats": {"sheets_skipped": 0, "rows_skipped": 0, "rows_compared": 0, "elapsed_seconds": 0.0},
+    }
+
+    old_package = _open_package(old_path)
+    new_package = _open_package(new_path) if old_package else None
+    if old_package and new_package:
+        try:
+            old_metrics, new_metrics = _compare_packages(old_package, new_package, report, progress_callback)
+        finally:
+            old_package.close()
+            new_package.close()
+    else:
+        if old_package:
+            old_package.close()
+        try:
+            old_reader = open_workbook(old_path, formulas=True)
+            new_reader = open_workbook(new_path, formulas=True)
+        except Exception as e:
+            logger.error(f"Error opening workbooks for comparison: {e}", exc_info=True)
+            raise Exception(f"Failed to open workbooks for comparison: {str(e)}")
+        try:
+            old_metrics, new_metrics = _compare_readers(old_reader, new_reader, report, progress_callback)
+        finally:
+            old_reader.close()
+            new_reader.close()
+
+    for key in RETURN_METRIC_PATTERNS:
+        old_metric = old_metrics.get(key)
+        new_metric = new_metrics.get(key)
+        if not old_metric and not new_metric:
+            continue
+        old_value = old_metric["value"] if old_metric else None
+        new_value = new_metric["value"] if new_metric else None
+        old_number = _to_number(old_value)
+        new_number = _to_number(new_value)
+        report["return_metrics"].append({
+            "metric": key,
+            "label": (new_metric or old_metric)["label"],
+            "location": (new_metric or old_metric)["location"],
+            "old": old_value,
+            "new": new_value,
+            "delta": new_number - old_number if old_number is not None and new_number is not None else None,
+            "changed": old_value != new_value,
+        })
+
+    report["stats"]["elapsed_seconds"] = round(time.perf_counter() - start, 3)
+    return report
+
+
+_BENCHMARK_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '{sheets}'
+    '<Override PartName="/xl/sharedStrings.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+_BENCHMARK_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="1"><fill><patternFill patternType="none"/></fill></fills>'
+    '<borders count="1"><border/></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+    '</styleSheet>'
+)
+_BENCHMARK_SHEETS = ("Inputs", "Cash Flows", "Returns")
+
+
+def _write_benchmark_package(zf, strings, sheets):
+    """Write a minimal .xlsx package around already rendered worksheet XML files"""
+    zf.writestr("[Content_Types].xml", _BENCHMARK_CONTENT_TYPES.format(sheets="".join(
+        f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+        f'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        for i in range(1, len(_BENCHMARK_SHEETS) + 1))))
+    zf.writestr("_rels/.rels",
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                '<Relationship Id="rId1" Target="xl/workbook.xml" Type="http://schemas.openxmlformats.org/'
+                'officeDocument/2006/relationships/officeDocument"/></Relationships>')
+    zf.writestr("xl/workbook.xml",
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+                'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets>' +
+                "".join(f'<sheet name="{name}" sheetId="{i}" r:id="rId{i}"/>'
+                        for i, name in enumerate(_BENCHMARK_SHEETS, 1)) +
+                '</sheets></workbook>')
+    zf.writestr("xl/_rels/workbook.xml.rels",
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">' +
+                "".join(f'<Relationship Id="rId{i}" Target="worksheets/sheet{i}.xml" Type="http://schemas.'
+                        f'openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+                        for i in range(1, len(_BENCHMARK_SHEETS) + 1)) +
+                f'<Relationship Id="rId{len(_BENCHMARK_SHEETS) + 1}" Target="sharedStrings.xml" '
+                'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings"/>'
+                f'<Relationship Id="rId{len(_BENCHMARK_SHEETS) + 2}" Target="styles.xml" '
+                'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles"/>'
+                '</Relationships>')
+    zf.writestr("xl/styles.xml", _BENCHMARK_STYLES)
+    zf.writestr("xl/sharedStrings.xml",
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                f'<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" count="{len(strings)}" '
+                f'uniqueCount="{len(strings)}">' +
+                "".join(f"<si><t>{html.escape(text)}</t></si>" for text in strings) + "</sst>")
+    for i, xml in enumerate(sheets, 1):
+        zf.writestr(f"xl/worksheets/sheet{i}.xml",
+                    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>' +
+                    xml + "</sheetData></worksheet>")
+
+
+def generate_benchmark_pair(directory, rows=330000, seed=0):
+    """
+    Write two versions of a large synthetic model for timing diff_workbooks
+
+    The cash flow sheet holds `rows` rows of labels, twelve hardcoded numbers and a shared
+    SUM formula; 330,000 rows give a workbook of roughly 40 MB. The second version changes a
+    few inputs, one shared string, one shared formula master and the NPV, and inserts a row with
+    a new label near the top of the cash flow sheet. As Excel does on save, the new label takes
+    its place in the shared string table in order of first use, shifting every later index.
+
+    Returns:
+        (old path, new path)
+    """
+    rng = random.Random(seed)
+    strings = ["Discount Rate", "Start Date", "Net Present Value (NPV)", "Internal Rate of Return (IRR)"]
+    strings += [f"Line item {i}" for i in range(rows)]
+    inserted_at = min(50, rows - 1)
+    new_strings = strings[:4 + inserted_at] + ["Inserted line item"] + strings[4 + inserted_at:]
+    new_strings[5 + rows // 2] = f"Line item {rows // 2} (revised)"
+    edited_rows = {rows // 3, rows // 2 + 7, rows - 10}
+    edited_group = rows // 4 // 1000
+
+    def inputs(discount_rate):
+        return (f'<row r="1"><c r="A1" t="s"><v>0</v></c><c r="B1"><v>{discount_rate}</v></c></row>'
+                '<row r="2"><c r="A2" t="s"><v>1</v></c><c r="B2" s="1"><v>45292</v></c></row>')
+
+    def returns(npv):
+        return (f'<row r="1"><c r="A1" t="s"><v>2</v></c><c r="B1"><v>{npv}</v></c></row>'
+                '<row r="2"><c r="A2" t="s"><v>3</v></c><c r="B2"><v>0.1432</v></c></row>')
+
+    old_rows = []
+    new_rows = []
+    for i in range(rows):
+        numbers = [round(rng.uniform(-1e6, 1e6), 2) for _ in range(12)]
+        for version, out in ((0, old_rows), (1, new_rows)):
+            if version and i >= inserted_at:
+                r = i + 2
+            else:
+                r = i + 1
+            if version and i == inserted_at:
+                out.append(f'<row r="{i + 1}"><c r="A{i + 1}" t="s"><v>{4 + i}</v></c>'
+                           f'<c r="B{i + 1}"><v>0.1</v></c></row>')
+            values = list(numbers)
+            if version and i in edited_rows:
+                values[3] += 1000
+            string_index = 4 + i + (1 if version and i >= inserted_at else 0)
+            cells = [f'<c r="A{r}" t="s"><v>{string_index}</v></c>']
+            cells += [f'<c r="{get_column_letter(j + 2)}{r}"><v>{value}</v></c>' for j, value in enumerate(values)]
+            total = round(sum(values), 2)
+            if i % 1000 == 0:
+                master = f"SUM(B{r}:L{r})" if version and i // 1000 == edited_group else f"SUM(B{r}:M{r})"
+                end = min(i + 1000, rows) + (1 if version and i + 1000 > inserted_at else 0)
+                cells.append(f'<c r="N{r}"><f t="shared" ref="N{r}:N{end}" si="{i // 1000}">{master}</f>'
+                             f'<v>{total}</v></c>')
+            else:
+                cells.append(f'<c r="N{r}"><f t="shared" si="{i // 1000}"/><v>{total}</v></c>')
+            out.append(f'<row r="{r}">{"".join(cells)}</row>')
+
+    old_path = os.path.join(directory, "benchmark_v1.xlsx")
+    new_path = os.path.join(directory, "benchmark_v2.xlsx")
+    for path, table, sheets in (
+            (old_path, strings, [inputs(0.12), "".join(old_rows), returns(-419141.78)]),
+            (new_path, new_strings, [inputs(0.1), "".join(new_rows), returns(-398012.5)])):
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+            _write_benchmark_package(zf, table, sheets)
+    return old_path, new_path
+
+
+def benchmark_diff(directory, rows=330000, seed=0):
+    """
+    Time diff_workbooks on a generated pair of large models
+
+    Returns:
+        Dictionary with the workbook size in MB, elapsed seconds and the diff report
+    """
+    old_path, new_path = generate_benchmark_pair(directory, rows=rows, seed=seed)
+    start = time.perf_counter()
+    report = diff_workbooks(old_path, new_path)
+    return {
+        "size_mb": round(os.path.getsize(new_path) / (1024 * 1024), 1),
+        "seconds": round(time.perf_counter() - start, 3),
+        "report": report,
+    }
+
+
+def format_diff_report(report):
+    """Render a diff report as plain text for the command line"""
+    lines = [f"Comparing {report['old_file']} -> {report['new_file']}"]
+    if report["sheets_added"]:
+        lines.append(f"Sheets added: {', '.join(report['sheets_added'])}")
+    if report["sheets_removed"]:
+        lines.append(f"Sheets removed: {', '.join(report['sheets_removed'])}")
+
+    lines.append("\nRETURN METRICS:")
+    for metric in report["return_metrics"]:
+        marker = "*" if metric["changed"] else " "
+        delta = f" (delta {metric['delta']:+,.6g})" if metric["delta"] else ""
+        lines.append(f" {marker} {metric['label']}: {metric['old']} -> {metric['new']}{delta} at {metric['location']}")
+
+    lines.append(f"\nCHANGED INPUTS ({len(report['changed_inputs'])}):")
+    for change in report["changed_inputs"]:
+        lines.append(f"  {change['location']} {change['label']}: {change['old']} -> {change['new']}")
+
+    lines.append(f"\nCHANGED FORMULAS ({len(report['changed_formulas'])}):")
+    for change in report["changed_formulas"]:
+        lines.append(f"  {change['location']} {change['label']}: {change['old_formula']} -> {change['new_formula']}")
+
+    lines.append(f"\nMOVED VALUES ({len(report['moved_values']) + len(report['moved_rows'])}):")
+    for move in report["moved_rows"]:
+        lines.append(f"  {move['sheet']} rows {move['from_rows']} -> rows {move['to_rows']}")
+    for move in report["moved_values"]:
+        lines.append(f"  {move['value']}: {move['from']} -> {move['to']}")
+
+    stats = report["stats"]
+    lines.append(f"\n{stats['sheets_skipped']} sheet(s) and {stats['rows_skipped']} row(s) identical, "
+                 f"{stats['rows_compared']} row(s) compared in {stats['elapsed_seconds']}s")
+    return "\n".join(lines)
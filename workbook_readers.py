@@ -0,0 +1,404 @@
+import os
+import re
+import csv
+import math
+import time
+import datetime
+import logging
+from collections import namedtuple
+from itertools import groupby
+from openpyxl import load_workbook
+
+logger = logging.getLogger(__name__)
+
+# A single non-empty cell; row and column are 1-based, formula is None when unknown or absent
+CellRecord = namedtuple("CellRecord", ["sheet", "row", "column", "value", "formula", "data_type"])
+
+EXCEL_ERRORS = {"#NULL!", "#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#NUM!", "#N/A", "#GETTING_DATA"}
+
+# ISO dates as written by Excel and pandas when exporting CSV, e.g. 2024-01-31 or 2024-01-31 00:00:00
+_ISO_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}([ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?$")
+
+# Plain decimal numbers; int() and float() also accept "1_000", "NaN" and "inf", which are kept as text
+_INTEGER_RE = re.compile(r"^[+-]?[0-9]+$")
+_DECIMAL_RE = re.compile(r"^[+-]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][+-]?[0-9]+)?$")
+
+# Registered backends per file extension, fastest first
+_REGISTRY = {}
+
+
+def _value_type(value, formula=None):
+    """Classify a cell value the same way for every backend"""
+    if value is None and formula:
+        # Formula without a cached result, e.g. a workbook saved by openpyxl
+        return "formula"
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time, datetime.timedelta)):
+        return "date"
+    if isinstance(value, str) and value in EXCEL_ERRORS:
+        return "error"
+    return "string"
+
+
+def _normalize_number(value):
+    """Backends without integer cells report 10000 as 10000.0; match openpyxl's output"""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _normalize_date(value):
+    """Date-only cells come back as datetime.date from some backends; match openpyxl's datetime"""
+    if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+        return datetime.datetime.combine(value, datetime.time())
+    return value
+
+
+class ReaderBackend:
+    """Base class for workbook readers that stream CellRecords sheet by sheet"""
+
+    name = None
+    extensions = ()
+    provides_formulas = False
+
+    @classmethod
+    def is_available(cls):
+        """Whether the library behind this backend can be imported"""
+        return True
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def sheet_names(self):
+        raise NotImplementedError
+
+    def iter_sheet(self, sheet_name, max_rows=None):
+        """Yield CellRecords for the non-empty cells of a sheet in row-major order"""
+        raise NotImplementedError
+
+    def iter_cells(self, max_rows=None):
+        """Yield CellRecords for every sheet in workbook order"""
+        for sheet_name in self.sheet_names:
+            yield from self.iter_sheet(sheet_name, max_rows)
+
+    def close(self):
+        pass
+
+
+class OpenpyxlBackend(ReaderBackend):
+    """Reads .xlsx/.xlsm with openpyxl, pairing cached values with formulas"""
+
+    name = "openpyxl"
+    extensions = (".xlsx", ".xlsm", ".xltx", ".xltm")
+    provides_formulas = True
+
+    def __init__(self, file_path, formulas=True):
+        super().__init__(file_path)
+        self._values = load_workbook(file_path, read_only=True, data_only=True)
+        # Formulas live in a second handle over the same XML, as in Analyzer.py
+        self._formulas = load_workbook(file_path, read_only=True, data_only=False) if formulas else None
+
+    @property
+    def sheet_names(self):
+        return self._values.sheetnames
+
+    def iter_sheet(self, sheet_name, max_rows=None):
+        value_rows = self._values[sheet_name].iter_rows(max_row=max_rows, values_only=True)
+        if self._formulas is None:
+            formula_rows = iter(lambda: (), None)
+        else:
+            formula_rows = self._formulas[sheet_name].iter_rows(max_row=max_rows, values_only=True)
+
+        for row_number, (values, raw) in enumerate(zip(value_rows, formula_rows), start=1):
+            for column, value in enumerate(values, start=1):
+                formula = raw[column - 1] if column <= len(raw) else None
+                if not (isinstance(formula, str) and formula.startswith('=')):
+                    formula = None
+                if value is None and formula is None:
+                    continue
+                yield CellRecord(sheet_name, row_number, column, value, formula, _value_type(value, formula))
+
+    def close(self):
+        self._values.close()
+        if self._formulas is not None:
+            self._formulas.close()
+
+
+class CalamineBackend(ReaderBackend):
+    """Reads every Excel format through the Rust calamine parser (values only)"""
+
+    name = "calamine"
+    extensions = (".xlsx", ".xlsm", ".xlsb", ".xls", ".ods")
+
+    @classmethod
+    def is_available(cls):
+        try:
+            import python_calamine  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def __init__(self, file_path, formulas=False):
+        super().__init__(file_path)
+        from python_calamine import CalamineWorkbook
+        self._workbook = CalamineWorkbook.from_path(file_path)
+
+    @property
+    def sheet_names(self):
+        return self._workbook.sheet_names
+
+    def iter_sheet(self, sheet_name, max_rows=None):
+        sheet = self._workbook.get_sheet_by_name(sheet_name)
+        # Keep the empty leading area so row and column numbers stay absolute
+        for row_number, values in enumerate(sheet.to_python(skip_empty_area=False, nrows=max_rows), start=1):
+            for column, value in enumerate(values, start=1):
+                if value == "" or value is None:
+                    continue
+                value = _normalize_date(_normalize_number(value))
+                yield CellRecord(sheet_name, row_number, column, value, None, _value_type(value))
+
+    def close(self):
+        close = getattr(self._workbook, "close", None)
+        if close:
+            close()
+
+
+class PyxlsbBackend(ReaderBackend):
+    """Reads binary .xlsb workbooks with pyxlsb (values only, dates stay as serial numbers)"""
+
+    name = "pyxlsb"
+    extensions = (".xlsb",)
+
+    @classmethod
+    def is_available(cls):
+        try:
+            import pyxlsb  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def __init__(self, file_path, formulas=False):
+        super().__init__(file_path)
+        import pyxlsb
+        self._workbook = pyxlsb.open_workbook(file_path)
+
+    @property
+    def sheet_names(self):
+        return self._workbook.sheets
+
+    def iter_sheet(self, sheet_name, max_rows=None):
+        with self._workbook.get_sheet(sheet_name) as sheet:
+            for row in sheet.rows(sparse=True):
+                for cell in row:
+                    if max_rows is not None and cell.r >= max_rows:
+                        return
+                    if cell.v is None or cell.v == "":
+                        continue
+                    value = _normalize_number(cell.v)
+                    yield CellRecord(sheet_name, cell.r + 1, cell.c + 1, value, None, _value_type(value))
+
+    def close(self):
+        self._workbook.close()
+
+
+class XlrdBackend(ReaderBackend):
+    """Reads legacy .xls workbooks with xlrd (values only)"""
+
+    name = "xlrd"
+    extensions = (".xls",)
+
+    @classmethod
+    def is_available(cls):
+        try:
+            import xlrd  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def __init__(self, file_path, formulas=False):
+        super().__init__(file_path)
+        import xlrd
+        self._xlrd = xlrd
+        self._workbook = xlrd.open_workbook(file_path, on_demand=True)
+
+    @property
+    def sheet_names(self):
+        return self._workbook.sheet_names()
+
+    def iter_sheet(self, sheet_name, max_rows=None):
+        xlrd = self._xlrd
+        sheet = self._workbook.sheet_by_name(sheet_name)
+        nrows = sheet.nrows if max_rows is None else min(sheet.nrows, max_rows)
+        for r in range(nrows):
+            for c, cell in enumerate(sheet.row(r)):
+                if cell.ctype in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK):
+                    continue
+                if cell.ctype == xlrd.XL_CELL_DATE:
+                    value = xlrd.xldate_as_datetime(cell.value, self._workbook.datemode)
+                elif cell.ctype == xlrd.XL_CELL_BOOLEAN:
+                    value = bool(cell.value)
+                elif cell.ctype == xlrd.XL_CELL_ERROR:
+                    value = xlrd.error_text_from_code.get(cell.value, "#VALUE!")
+                else:
+                    value = _normalize_number(cell.value)
+                yield CellRecord(sheet_name, r + 1, c + 1, value, None, _value_type(value))
+        self._workbook.unload_sheet(sheet_name)
+
+    def close(self):
+        self._workbook.release_resources()
+
+
+class CsvBackend(ReaderBackend):
+    """Reads a CSV file as a single sheet named after the file, converting numeric and ISO date text"""
+
+    name = "csv"
+    extensions = (".csv",)
+
+    def __init__(self, file_path, formulas=False):
+        super().__init__(file_path)
+        self._sheet_name = os.path.splitext(os.path.basename(file_path))[0]
+
+    @property
+    def sheet_names(self):
+        return [self._sheet_name]
+
+    def iter_sheet(self, sheet_name, max_rows=None):
+        with open(self.file_path, newline="", encoding="utf-8-sig") as f:
+            for row_number, row in enumerate(csv.reader(f), start=1):
+                if max_rows is not None and row_number > max_rows:
+                    break
+                for column, text in enumerate(row, start=1):
+                    if text == "":
+                        continue
+                    value = text
+                    number = text.strip()
+                    if _INTEGER_RE.match(number):
+                        value = int(number)
+                    elif _DECIMAL_RE.match(number):
+                        # Out of range exponents such as 1e400 would become inf, which is not valid JSON
+                        if math.isfinite(float(number)):
+                            value = float(number)
+                    elif _ISO_DATE_RE.match(text):
+                        value = datetime.datetime.fromisoformat(text)
+                    yield CellRecord(sheet_name, row_number, column, value, None, _value_type(value))
+
+
+def register_backend(backend, priority=None):
+    """
+    Register a reader backend for each of its extensions
+
+    Args:
+        backend: ReaderBackend subclass
+        priority: Position in the per-extension list (0 is tried first); appended if None
+    """
+    for extension in backend.extensions:
+        backends = _REGISTRY.setdefault(extension, [])
+        if backend in backends:
+            backends.remove(backend)
+        backends.insert(len(backends) if priority is None else priority, backend)
+
+
+# Fastest first: calamine parses in Rust but cannot return formulas
+register_backend(CalamineBackend)
+register_backend(OpenpyxlBackend)
+register_backend(PyxlsbBackend)
+register_backend(XlrdBackend)
+register_backend(CsvBackend)
+
+
+def supported_extensions():
+    """Extensions that at least one installed backend can read"""
+    return sorted(ext for ext, backends in _REGISTRY.items()
+                  if any(backend.is_available() for backend in backends))
+
+
+def available_backends(file_path, formulas=False):
+    """Installed backends able to read a file, fastest first"""
+    extension = os.path.splitext(file_path)[1].lower()
+    return [backend for backend in _REGISTRY.get(extension, [])
+            if backend.is_available() and (backend.provides_formulas or not formulas)]
+
+
+def open_workbook(file_path, formulas=False, backend=None):
+    """
+    Open a workbook with the fastest installed backend for its format
+
+    Args:
+        file_path: Path to the workbook or CSV file
+        formulas: Prefer a backend that reports formulas; falls back to values only
+        backend: Name of a specific backend to use instead of choosing automatically
+
+    Returns:
+        An open ReaderBackend; use it as a context manager
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension not in _REGISTRY:
+        raise ValueError(f"Unsupported file type '{extension}'. Supported: {', '.join(supported_extensions())}")
+
+    if backend is not None:
+        candidates = [b for b in _REGISTRY[extension] if b.name == backend and b.is_available()]
+    else:
+        candidates = available_backends(file_path, formulas) or available_backends(file_path)
+    if not candidates:
+        names = ", ".join(b.name for b in _REGISTRY[extension])
+        raise ValueError(f"No installed reader for '{extension}' files. Install one of: {names}")
+
+    return candidates[0](file_path, formulas=formulas)
+
+
+def iter_cells(file_path, formulas=False, max_rows=None, backend=None):
+    """Stream CellRecords from every sheet of a workbook"""
+    with open_workbook(file_path, formulas=formulas, backend=backend) as reader:
+        yield from reader.iter_cells(max_rows)
+
+
+def iter_rows(records):
+    """
+    Group a CellRecord stream into dense rows
+
+    Yields:
+        (sheet, row_number, values, formulas) where values and formulas are lists indexed by column - 1
+    """
+    for (sheet, row_number), cells in groupby(records, key=lambda record: (record.sheet, record.row)):
+        cells = list(cells)
+        width = cells[-1].column
+        values = [None] * width
+        formulas = [None] * width
+        for cell in cells:
+            values[cell.column - 1] = cell.value
+            formulas[cell.column - 1] = cell.formula
+        yield sheet, row_number, values, formulas
+
+
+def benchmark_backends(file_path, repeat=3, formulas=False):
+    """
+    Time every installed backend able to read a file
+
+    Returns:
+        List of dictionaries with backend name, best time in seconds and cell count, fastest first
+    """
+    results = []
+    for backend in available_backends(file_path, formulas):
+        timings = []
+        cells = 0
+        try:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                cells = sum(1 for _ in iter_cells(file_path, formulas=formulas, backend=backend.name))
+                timings.append(time.perf_counter() - start)
+        except Exception as e:
+            logger.error(f"Backend {backend.name} failed on {file_path}: {e}", exc_info=True)
+            results.append({"backend": backend.name, "seconds": None, "cells": 0, "error": str(e)})
+            continue
+        results.append({"backend": backend.name, "seconds": round(min(timings), 4), "cells": cells})
+    return sorted(results, key=lambda result: (result["seconds"] is None, result["seconds"] or 0))